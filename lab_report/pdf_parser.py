@@ -5,14 +5,35 @@ Handles structured tables, borderless tables, and raw-text fallback.
 Works with Apollo, SRL, Thyrocare, Metropolis report formats.
 """
 
+import io
+import multiprocessing
+import os
 import pdfplumber
 import pandas as pd
 import re
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import repeat
 from pathlib import Path
+from typing import BinaryIO
 from scripts.logger import get_logger
+from scripts.config import config
+
+try:
+    import pymupdf  # MuPDF's C text layer — much faster than pdfminer for plain text
+except ImportError:
+    pymupdf = None
 
 logger = get_logger("lab_report.pdf_parser")
 
+# Poppler's pdftotext, if installed: fastest text source, and -layout keeps
+# column alignment that the text-fallback patterns rely on
+PDFTOTEXT = shutil.which("pdftotext")
+PDFTOTEXT_TIMEOUT = 10  # seconds
+
 # Known Indian lab report header aliases
 HEADER_ALIASES = {
     "test":      ["test", "parameter", "investigation", "test name", "description", "analyte"],
@@ -22,17 +43,47 @@ HEADER_ALIASES = {
     "status":    ["status", "flag", "remark", "remarks", "interpretation"],
 }
 
+# Reports with at least this many pages are parsed across worker processes
+PARALLEL_PAGE_THRESHOLD = 4
+
 # Lines to skip during text extraction
 SKIP_PATTERNS = re.compile(
     r"^(page|report|date|time|printed|lab|doctor|address|phone|email|gender|sex|sample|specimen|barcode|accession|ref\s*by|referred|collected|received|reported|technician|pathologist|authorised|authorized|signature|stamp|www|http)",
     re.IGNORECASE,
 )
 
+# Test-name cleanup: "1. " / "1) " prefixes, runs of spaces, separator rows
+_LEADING_INDEX_RE = re.compile(r"^\d+[\.\)]\s*")
+_MULTI_SPACE_RE = re.compile(r"\s{2,}")
+_SEPARATOR_ROW_RE = re.compile(r"^[\-\*\=\_\s]+$")
+
+# Text-fallback row patterns, fused into one MULTILINE alternation and compiled
+# once. Whitespace is horizontal-only ([ \t]) so a match never spans lines;
+# the leading lookahead applies SKIP_PATTERNS to each line.
+_TEXT_ROW_PATTERN = re.compile(
+    r"^[ \t]*(?!(?i:" + SKIP_PATTERNS.pattern.replace("^(", "(?:", 1) + r"))(?:"
+    # Pattern A: tab/space separated columns
+    r"([A-Za-z][A-Za-z \t\(\)\/\-\.]{2,45?}?)[ \t]{2,}"   # test name (2+ spaces separator)
+    r"([\d]+\.?[\d]*)[ \t]*"                                  # numeric value
+    r"([a-zA-Z\/\%µgLUd]{1,12})?[ \t]*"                       # unit
+    r"([\d]+\.?[\d]*[ \t]*[-–][ \t]*[\d]+\.?[\d]*)?"        # reference range
+    r"|"
+    # Pattern B: colon-separated  "Test Name : value unit"
+    r"([A-Za-z][A-Za-z \t\(\)\/\-\.]{2,40})[ \t]*[:\-][ \t]*"
+    r"([\d]+\.?[\d]*)[ \t]*"
+    r"([a-zA-Z\/\%µgLUd]{1,12})?"
+    r")",
+    re.MULTILINE,
+)
 
-def extract_lab_values(pdf_path: str) -> dict:
+
+def extract_lab_values(pdf_path: str | BinaryIO) -> dict:
     """
     Extract lab test values from a PDF report.
 
+    Args:
+        pdf_path: File path, or a binary stream (e.g. io.BytesIO of an upload).
+
     Extraction strategy (in order of preference):
     1. Explicit bordered tables (pdfplumber default)
     2. Borderless/whitespace-aligned tables (custom strategy)
@@ -47,11 +98,15 @@ def extract_lab_values(pdf_path: str) -> dict:
           "extraction_method": str,
         }
     """
-    path = Path(pdf_path)
-    if not path.exists():
-        raise FileNotFoundError(f"PDF not found: {pdf_path}")
+    if isinstance(pdf_path, (str, os.PathLike)):
+        path = Path(pdf_path)
+        if not path.exists():
+            raise FileNotFoundError(f"PDF not found: {pdf_path}")
+        source_name = path.name
+    else:
+        source_name = getattr(pdf_path, "name", None) or "<stream>"
 
-    logger.info(f"📄 Parsing PDF: {path.name}")
+    logger.info(f"📄 Parsing PDF: {source_name}")
 
     raw_text = ""
     lab_values = []
@@ -62,33 +117,30 @@ def extract_lab_values(pdf_path: str) -> dict:
         total_pages = len(pdf.pages)
         logger.info(f"  Total pages: {total_pages}")
 
-        for page_num, page in enumerate(pdf.pages, 1):
+        if total_pages >= PARALLEL_PAGE_THRESHOLD and config.PDF_PARSE_WORKERS > 1:
+            pages = _extract_pages_parallel(_worker_source(pdf_path), total_pages)
+        else:
+            layers = _fast_page_layers(pdf_path, 0, total_pages) or repeat((None, True))
+            # Lazy generator: `not lab_values` is evaluated as each page is
+            # consumed, so Strategy 2 only runs while nothing has been found yet.
+            pages = (
+                _extract_page(page, try_borderless=not lab_values, text=text, has_rulings=has_rulings)
+                for page, (text, has_rulings) in zip(pdf.pages, layers)
+            )
+
+        for page_num, (page_text, bordered, borderless) in enumerate(pages, 1):
             logger.info(f"  Processing page {page_num}/{total_pages}")
-            page_text = page.extract_text() or ""
             raw_text += page_text + "\n"
 
             if page_num == 1:
                 patient_info = _extract_patient_info(page_text)
 
             # Strategy 1: Standard bordered tables
-            tables = page.extract_tables({
-                "vertical_strategy": "lines",
-                "horizontal_strategy": "lines",
-            })
-            for table in tables:
-                parsed = _parse_lab_table(table)
-                lab_values.extend(parsed)
+            lab_values.extend(bordered)
 
             # Strategy 2: Borderless tables (text + whitespace alignment)
             if not lab_values:
-                tables_text = page.extract_tables({
-                    "vertical_strategy": "text",
-                    "horizontal_strategy": "text",
-                    "intersection_y_tolerance": 10,
-                })
-                for table in tables_text:
-                    parsed = _parse_lab_table(table)
-                    lab_values.extend(parsed)
+                lab_values.extend(borderless)
 
         # Strategy 3: Raw text regex fallback
         if not lab_values:
@@ -111,8 +163,206 @@ def extract_lab_values(pdf_path: str) -> dict:
     }
 
 
+# ── Per-page Extraction ───────────────────────────────────────────────────────
+
+def _extract_page(
+    page,
+    try_borderless: bool = True,
+    text: str | None = None,
+    has_rulings: bool = True,
+) -> tuple[str, list[dict], list[dict]]:
+    """
+    Extract one page: (text, Strategy-1 rows, Strategy-2 rows).
+    Strategy 2 only runs when requested and Strategy 1 found nothing on this page.
+    `text` / `has_rulings` come from PyMuPDF when available: pdfplumber is then
+    only used for table geometry, and the ruled-table pass is skipped on pages
+    with no vector graphics (no lines or rects means no bordered tables).
+    """
+    if text is not None:
+        if not text.strip():
+            page.close()
+            return "", [], []  # image-only page, detected without a pdfminer pass
+        page_text = text
+    else:
+        # page.chars runs the one pdfminer layout pass; pdfplumber caches the parsed
+        # objects on the Page, so the text and table passes below all reuse it.
+        if not page.chars:
+            page.close()
+            return "", [], []  # image-only page: no text, so no parsable tables either
+        page_text = page.extract_text() or ""
+
+    bordered = []
+    if has_rulings:
+        for table in page.extract_tables({
+            "vertical_strategy": "lines",
+            "horizontal_strategy": "lines",
+        }):
+            bordered.extend(_parse_lab_table(table))
+
+    borderless = []
+    if try_borderless and not bordered:
+        for table in page.extract_tables({
+            "vertical_strategy": "text",
+            "horizontal_strategy": "text",
+            "intersection_y_tolerance": 10,
+        }):
+            borderless.extend(_parse_lab_table(table))
+
+    page.close()  # release this page's cached layout before moving on
+    return page_text, bordered, borderless
+
+
+def _fast_page_layers(pdf_path: str | bytes | BinaryIO, start: int, stop: int) -> list[tuple[str, bool]] | None:
+    """
+    (text in reading order, has vector graphics) for pages [start, stop).
+    Text comes from pdftotext when installed, else PyMuPDF; the graphics flag
+    needs PyMuPDF (assumed True without it). Returns None when neither tool
+    can read the file, in which case callers fall back to pdfplumber for everything.
+    """
+    texts = _pdftotext_pages(pdf_path, start, stop)
+    rulings = [True] * (stop - start)
+
+    if pymupdf is not None:
+        try:
+            if isinstance(pdf_path, (str, os.PathLike)):
+                doc = pymupdf.open(pdf_path)
+            else:
+                doc = pymupdf.open(stream=_worker_source(pdf_path), filetype="pdf")
+            with doc:
+                pages = [doc[i] for i in range(start, stop)]
+                if texts is None:
+                    texts = [page.get_text(sort=True) for page in pages]
+                rulings = [bool(page.get_cdrawings()) for page in pages]
+        except Exception as e:
+            logger.warning(f"  PyMuPDF extraction failed ({e}) — using pdfplumber")
+
+    if texts is None:
+        return None
+    return list(zip(texts, rulings))
+
+
+def _pdftotext_pages(pdf_path: str | bytes | BinaryIO, start: int, stop: int) -> list[str] | None:
+    """Text of pages [start, stop) from `pdftotext -layout`; None if unavailable or it fails."""
+    if PDFTOTEXT is None:
+        return None
+
+    if isinstance(pdf_path, (str, os.PathLike)):
+        source, stdin = str(pdf_path), None
+    else:
+        source, stdin = "-", _worker_source(pdf_path)  # read the PDF from stdin
+
+    try:
+        proc = subprocess.run(
+            [PDFTOTEXT, "-layout", "-q", "-f", str(start + 1), "-l", str(stop), source, "-"],
+            input=stdin,
+            capture_output=True,
+            timeout=PDFTOTEXT_TIMEOUT,
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"  pdftotext failed ({e}) — using Python text extraction")
+        return None
+    if proc.returncode != 0:
+        return None
+
+    # Every page is terminated by a form feed
+    pages = proc.stdout.decode("utf-8", errors="replace").split("\f")[: stop - start]
+    return pages if len(pages) == stop - start else None
+
+
+def _worker_source(pdf_path: str | bytes | BinaryIO) -> str | bytes:
+    """Something picklable each worker can reopen: the path, or the stream's bytes."""
+    if isinstance(pdf_path, (str, os.PathLike)):
+        return str(pdf_path)
+    if isinstance(pdf_path, bytes):
+        return pdf_path
+    if isinstance(pdf_path, io.BytesIO):
+        return pdf_path.getvalue()
+    pdf_path.seek(0)
+    data = pdf_path.read()
+    pdf_path.seek(0)
+    return data
+
+
+def _extract_page_range(pdf_path: str | bytes, start: int, stop: int) -> list[tuple[str, list[dict], list[dict]]]:
+    """Worker: open the PDF independently and extract pages [start, stop)."""
+    layers = _fast_page_layers(pdf_path, start, stop) or repeat((None, True))
+    source = io.BytesIO(pdf_path) if isinstance(pdf_path, bytes) else pdf_path
+    with pdfplumber.open(source) as pdf:
+        return [
+            _extract_page(page, text=text, has_rulings=has_rulings)
+            for page, (text, has_rulings) in zip(pdf.pages[start:stop], layers)
+        ]
+
+
+_page_pool: ProcessPoolExecutor | None = None
+_page_pool_lock = threading.Lock()
+
+
+def _get_page_pool() -> ProcessPoolExecutor:
+    """
+    Lazily start one process pool shared by every parse in this process,
+    sized to this API worker's share of the cores (PDF_PARSE_WORKERS).
+    Workers come from forkserver (spawn where unavailable) so they never
+    inherit a forked copy of the API/Streamlit threads and their locks.
+    """
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is None:
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _page_pool = ProcessPoolExecutor(
+                max_workers=config.PDF_PARSE_WORKERS,
+                mp_context=multiprocessing.get_context(method),
+            )
+        return _page_pool
+
+
+def _reset_page_pool(pool: ProcessPoolExecutor) -> None:
+    """Drop a broken pool so the next parse starts a fresh one."""
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is pool:
+            _page_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _extract_pages_parallel(pdf_path: str | bytes, total_pages: int) -> list[tuple[str, list[dict], list[dict]]]:
+    """
+    Split the page range across processes (pdfplumber is CPU-bound pure Python).
+    Falls back to a sequential pass if the pool cannot be started.
+    """
+    workers = min(config.PDF_PARSE_WORKERS, total_pages)
+    starts = [i * total_pages // workers for i in range(workers)]
+    stops = starts[1:] + [total_pages]
+    logger.info(f"  Parsing {total_pages} pages across {workers} processes")
+
+    pool = None
+    try:
+        pool = _get_page_pool()
+        chunks = pool.map(_extract_page_range, repeat(pdf_path), starts, stops)
+        return [page for chunk in chunks for page in chunk]
+    except Exception as e:
+        if isinstance(e, BrokenProcessPool) and pool is not None:
+            _reset_page_pool(pool)
+        logger.warning(f"  Parallel parse failed ({e}) — falling back to sequential")
+        return _extract_page_range(pdf_path, 0, total_pages)
+
+
 # ── Patient Info Extraction ───────────────────────────────────────────────────
 
+# Tried in order: an explicit "Patient Name:" beats an honorific anywhere
+# else in the header (which is often the referring doctor).
+_NAME_PATTERNS = [
+    re.compile(r"(?:Patient\s*Name|Name)\s*[:\-]?\s*([A-Z][a-zA-Z]+(?: [A-Z][a-zA-Z]+){1,3})"),
+    re.compile(r"(?:Mr\.|Mrs\.|Ms\.|Dr\.)\s*([A-Z][a-zA-Z]+(?: [A-Z][a-zA-Z]+){1,3})"),
+]
+_AGE_RE = re.compile(r"(?:Age)\s*[:\-]?\s*(\d{1,3})\s*(?:Yrs?\.?|Years?)?", re.IGNORECASE)
+_GENDER_RE = re.compile(r"(?:Sex|Gender)\s*[:\-]?\s*(Male|Female|M|F)\b", re.IGNORECASE)
+_DATE_RE = re.compile(r"(?:Date|Collected|Reported)\s*[:\-]?\s*(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})", re.IGNORECASE)
+
+# Known lab names, in priority order, matched in one case-insensitive scan
+KNOWN_LABS = ["Apollo", "SRL", "Thyrocare", "Metropolis", "LIMS", "Dr Lal", "Vijaya", "CARE"]
+_LAB_RE = re.compile(r"\b(" + "|".join(map(re.escape, KNOWN_LABS)) + r")\b", re.IGNORECASE)
+
 def _extract_patient_info(text: str) -> dict:
     """Extract patient demographics and lab metadata from header text."""
     info = {
@@ -124,35 +374,32 @@ def _extract_patient_info(text: str) -> dict:
     }
 
     # Name — multiple formats
-    for pattern in [
-        r"(?:Patient\s*Name|Name)\s*[:\-]?\s*([A-Z][a-zA-Z]+(?: [A-Z][a-zA-Z]+){1,3})",
-        r"(?:Mr\.|Mrs\.|Ms\.|Dr\.)\s*([A-Z][a-zA-Z]+(?: [A-Z][a-zA-Z]+){1,3})",
-    ]:
-        m = re.search(pattern, text)
+    for pattern in _NAME_PATTERNS:
+        m = pattern.search(text)
         if m:
             info["name"] = m.group(1).strip()
             break
 
     # Age
-    m = re.search(r"(?:Age)\s*[:\-]?\s*(\d{1,3})\s*(?:Yrs?\.?|Years?)?", text, re.IGNORECASE)
+    m = _AGE_RE.search(text)
     if m:
         info["age"] = m.group(1)
 
     # Gender
-    m = re.search(r"(?:Sex|Gender)\s*[:\-]?\s*(Male|Female|M|F)\b", text, re.IGNORECASE)
+    m = _GENDER_RE.search(text)
     if m:
         g = m.group(1).upper()
         info["gender"] = "Male" if g in ("M", "MALE") else "Female"
 
     # Date (multiple formats)
-    m = re.search(r"(?:Date|Collected|Reported)\s*[:\-]?\s*(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})", text, re.IGNORECASE)
+    m = _DATE_RE.search(text)
     if m:
         info["date"] = m.group(1)
 
-    # Lab name (first all-caps line or known lab names)
-    known_labs = ["Apollo", "SRL", "Thyrocare", "Metropolis", "LIMS", "Dr Lal", "Vijaya", "CARE"]
-    for lab in known_labs:
-        if lab.lower() in text.lower():
+    # Lab name (known lab names, first in KNOWN_LABS order wins)
+    found = {m.lower() for m in _LAB_RE.findall(text)}
+    for lab in KNOWN_LABS:
+        if lab.lower() in found:
             info["lab_name"] = lab
             break
 
@@ -165,19 +412,21 @@ def _parse_lab_table(table: list) -> list[dict]:
     """
     Parse a pdfplumber table matrix into structured lab value dicts.
     Handles merged cells, multi-line test names, and missing columns.
+    Cell cleanup and row filtering run as vectorised pandas string ops.
     """
-    results = []
     if not table or len(table) < 2:
-        return results
+        return []
 
-    # Clean table: normalize None → ""
-    table = [[str(cell).strip() if cell else "" for cell in row] for row in table]
+    # Clean table: ragged rows are padded, None → "", strip every cell
+    df = pd.DataFrame(table).fillna("").astype(str)
+    df = df.apply(lambda col: col.str.strip())
+    n_cols = df.shape[1]
 
     # Find header row (first row with recognizable column names)
     header_row_idx = 0
     col_map = {}
-    for row_idx, row in enumerate(table[:4]):  # scan first 4 rows for header
-        row_lower = [c.lower() for c in row]
+    for row_idx in range(min(4, len(df))):  # scan first 4 rows for header
+        row_lower = df.iloc[row_idx].str.lower().tolist()
         col_map = _map_columns(row_lower)
         if col_map.get("test") is not None and col_map.get("value") is not None:
             header_row_idx = row_idx
@@ -188,41 +437,38 @@ def _parse_lab_table(table: list) -> list[dict]:
         col_map = {"test": 0, "value": 1, "unit": 2, "reference": 3, "status": 4}
 
     test_col = col_map.get("test", 0)
-    value_col = col_map.get("value", 1)
-    unit_col = col_map.get("unit", 2)
-    ref_col = col_map.get("reference", 3)
-    status_col = col_map.get("status", 4)
-
-    for row in table[header_row_idx + 1:]:
-        if len(row) <= test_col:
-            continue
-
-        test_name = row[test_col].strip()
-
-        # Skip empty rows, section headers, and footer lines
-        if not test_name:
-            continue
-        if SKIP_PATTERNS.match(test_name):
-            continue
-        if len(test_name) < 2 or test_name.lower() in ("test", "parameter", "investigation", "total"):
-            continue
-        if re.match(r"^[\-\*\=\_\s]+$", test_name):  # decorative separator lines
-            continue
+    if test_col >= n_cols:
+        return []
+
+    body = df.iloc[header_row_idx + 1:]
+    names = body[test_col]
+
+    # Skip empty rows, section headers, footer lines, and decorative separators
+    keep = (
+        (names.str.len() >= 2)
+        & ~names.str.match(SKIP_PATTERNS)
+        & ~names.str.lower().isin(("test", "parameter", "investigation", "total"))
+        & ~names.str.match(_SEPARATOR_ROW_RE)
+    )
+    body = body[keep]
+    if body.empty:
+        return []
 
-        def safe_get(col):
-            if col is not None and col < len(row):
-                return row[col].strip()
-            return ""
+    # Fields the header had no alias for fall back to their usual position
+    positions = {"value": 1, "unit": 2, "reference": 3, "status": 4}
 
-        results.append({
-            "test": _clean_test_name(test_name),
-            "value": safe_get(value_col),
-            "unit": safe_get(unit_col),
-            "reference": safe_get(ref_col),
-            "status": safe_get(status_col),
-        })
+    def column(field: str):
+        col = col_map.get(field, positions[field])
+        return body[col] if col < n_cols else ""
 
-    return results
+    records = pd.DataFrame({
+        "test": _clean_test_names(body[test_col]),
+        "value": column("value"),
+        "unit": column("unit"),
+        "reference": column("reference"),
+        "status": column("status"),
+    })
+    return records.to_dict(orient="records")
 
 
 def _map_columns(header_row: list) -> dict:
@@ -238,11 +484,20 @@ def _map_columns(header_row: list) -> dict:
 
 def _clean_test_name(name: str) -> str:
     """Normalize test names: remove leading numbers, extra whitespace."""
-    name = re.sub(r"^\d+[\.\)]\s*", "", name)  # remove "1. " or "1) "
-    name = re.sub(r"\s{2,}", " ", name)
+    name = _LEADING_INDEX_RE.sub("", name)  # remove "1. " or "1) "
+    name = _MULTI_SPACE_RE.sub(" ", name)
     return name.strip()
 
 
+def _clean_test_names(names: pd.Series) -> pd.Series:
+    """Vectorised _clean_test_name over a column of test names."""
+    return (
+        names.str.replace(_LEADING_INDEX_RE, "", regex=True)
+        .str.replace(_MULTI_SPACE_RE, " ", regex=True)
+        .str.strip()
+    )
+
+
 # ── Text Fallback Extraction ──────────────────────────────────────────────────
 
 def _extract_from_text(text: str) -> list[dict]:
@@ -253,40 +508,25 @@ def _extract_from_text(text: str) -> list[dict]:
       SGPT/ALT  :  42  U/L  (0-40)
     """
     results = []
-    lines = text.split("\n")
-
-    # Pattern A: tab/space separated columns
-    pattern_cols = re.compile(
-        r"^([A-Za-z][A-Za-z\s\(\)\/\-\.]{2,45?}?)\s{2,}"   # test name (2+ spaces separator)
-        r"([\d]+\.?[\d]*)\s*"                                  # numeric value
-        r"([a-zA-Z\/\%µgLUd]{1,12})?\s*"                     # unit
-        r"([\d]+\.?[\d]*\s*[-–]\s*[\d]+\.?[\d]*)?"           # reference range
-    )
 
-    # Pattern B: colon-separated  "Test Name : value unit"
-    pattern_colon = re.compile(
-        r"^([A-Za-z][A-Za-z\s\(\)\/\-\.]{2,40})\s*[:\-]\s*"
-        r"([\d]+\.?[\d]*)\s*"
-        r"([a-zA-Z\/\%µgLUd]{1,12})?"
-    )
+    # One finditer over the whole text instead of split + two matches per line
+    for m in _TEXT_ROW_PATTERN.finditer(text):
+        if m.group(1) is not None:  # Pattern A
+            test_raw, value, unit, reference = m.group(1, 2, 3, 4)
+        else:                       # Pattern B
+            test_raw, value, unit = m.group(5, 6, 7)
+            reference = None
 
-    for line in lines:
-        line = line.strip()
-        if not line or len(line) < 5 or SKIP_PATTERNS.match(line):
+        test = _clean_test_name(test_raw)
+        if len(test) < 3:
             continue
-
-        m = pattern_cols.match(line) or pattern_colon.match(line)
-        if m:
-            test = _clean_test_name(m.group(1))
-            if len(test) < 3:
-                continue
-            results.append({
-                "test": test,
-                "value": m.group(2) if m.lastindex >= 2 else "N/A",
-                "unit": m.group(3) if m.lastindex >= 3 and m.group(3) else "",
-                "reference": m.group(4) if m.lastindex >= 4 and m.group(4) else "",
-                "status": "",
-            })
+        results.append({
+            "test": test,
+            "value": value,
+            "unit": unit or "",
+            "reference": reference or "",
+            "status": "",
+        })
 
     return results
 
@@ -295,15 +535,12 @@ def _extract_from_text(text: str) -> list[dict]:
 
 def _deduplicate(lab_values: list[dict]) -> list[dict]:
     """Remove duplicate test entries, keeping the one with more data."""
-    seen = {}
+    # key → (non-empty field count, item); each item is scored exactly once
+    seen: dict[str, tuple[int, dict]] = {}
     for item in lab_values:
         key = item["test"].lower().strip()
-        if key not in seen:
-            seen[key] = item
-        else:
-            # Keep whichever has more non-empty fields
-            existing_score = sum(1 for v in seen[key].values() if v)
-            new_score = sum(1 for v in item.values() if v)
-            if new_score > existing_score:
-                seen[key] = item
-    return list(seen.values())
+        score = sum(map(bool, item.values()))
+        # Keep whichever has more non-empty fields
+        if key not in seen or score > seen[key][0]:
+            seen[key] = (score, item)
+    return [item for _, item in seen.values()]
@@ -7,16 +7,85 @@ RAG Pipeline + Gemini LLM Analysis
 - Critical alert detection for Module C integration
 """
 
+import asyncio
+import copy
+import hashlib
+import io
 import json
 import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, wraps
+from typing import BinaryIO, Iterator
+import numpy as np
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.schema import HumanMessage, SystemMessage
-from lab_report.vector_store import build_vector_store, query_benchmark
+from lab_report.vector_store_np import build_vector_store, query_benchmarks_batch
 from scripts.logger import get_logger
 from scripts.config import config
 
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
 logger = get_logger("lab_report.rag_pipeline")
 
+
+def _fingerprint(data: bytes) -> bytes:
+    """Content key for an uploaded file — xxh3 when installed, else blake2b."""
+    if xxhash is not None:
+        return xxhash.xxh3_128_digest(data)
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+# Parsed reports kept outside Streamlit; each holds a whole report's rows
+PIPELINE_CACHE_SIZE = 8
+
+
+def _fingerprint_lru(fn):
+    """
+    Small LRU for one-argument functions of PDF bytes. Keyed on the
+    fingerprint, so uploads aren't pinned in memory, and every caller gets
+    its own copy of the result to mutate.
+    """
+    cache: OrderedDict[bytes, dict] = OrderedDict()
+    lock = threading.Lock()
+
+    @wraps(fn)
+    def wrapper(pdf_bytes: bytes) -> dict:
+        key = _fingerprint(pdf_bytes)
+        with lock:
+            result = cache.get(key)
+            if result is not None:
+                cache.move_to_end(key)
+        if result is None:
+            result = fn(pdf_bytes)
+            with lock:
+                cache[key] = result
+                while len(cache) > PIPELINE_CACHE_SIZE:
+                    cache.popitem(last=False)
+        return copy.deepcopy(result)
+
+    wrapper.cache_clear = cache.clear
+    return wrapper
+
+
+# Process-wide caches: Streamlit's resource/data caches when running under
+# `streamlit run`, plain in-process caches for FastAPI / scripts / tests.
+# Streamlit would md5 every multi-MB PDF on each rerun to build the key; a
+# fast fingerprint stands in for the bytes instead.
+try:
+    import streamlit as st
+    _resource_cache = st.cache_resource(show_spinner=False)
+    _pipeline_cache = st.cache_data(
+        persist="disk", max_entries=200, show_spinner=False, hash_funcs={bytes: _fingerprint},
+    )
+except ImportError:
+    _resource_cache = lru_cache(maxsize=1)
+    _pipeline_cache = _fingerprint_lru
+
 RISK_LEVELS = {
     "NORMAL":   {"icon": "✅", "color": "#00cc44", "priority": 0},
     "LOW":      {"icon": "⬇️", "color": "#ffcc00", "priority": 1},
@@ -51,60 +120,125 @@ def _get_llm() -> ChatGoogleGenerativeAI:
     )
 
 
+# LRU of Gemini responses keyed by (system, prompt, model). The prompt already
+# embeds the language, so re-analysing the same report is free.
+_LLM_CACHE_SIZE = 256
+_llm_response_cache: OrderedDict[tuple[str, str, str], str] = OrderedDict()
+# Used from FastAPI executor threads, _run_async helpers and Streamlit
+# script threads at once; the get/move/evict sequences must not interleave
+_llm_response_cache_lock = threading.Lock()
+
+
+def _llm_cache_get(key: tuple[str, str, str]) -> str | None:
+    with _llm_response_cache_lock:
+        cached = _llm_response_cache.get(key)
+        if cached is not None:
+            _llm_response_cache.move_to_end(key)
+        return cached
+
+
+def _llm_cache_put(key: tuple[str, str, str], text: str) -> None:
+    with _llm_response_cache_lock:
+        _llm_response_cache[key] = text
+        _llm_response_cache.move_to_end(key)
+        if len(_llm_response_cache) > _LLM_CACHE_SIZE:
+            _llm_response_cache.popitem(last=False)
+
+
+async def _cached_ainvoke(llm, system: str, prompt: str) -> str:
+    """llm.ainvoke() memoised on (system, prompt, model); returns stripped text."""
+    key = (system, prompt, getattr(llm, "model", ""))
+    cached = _llm_cache_get(key)
+    if cached is not None:
+        return cached
+
+    response = await llm.ainvoke([
+        SystemMessage(content=system),
+        HumanMessage(content=prompt),
+    ])
+    text = response.content.strip()
+    _llm_cache_put(key, text)
+    return text
+
+
+@_resource_cache
+def _get_collection():
+    """Benchmark index (NumPy backend), built once per process."""
+    return build_vector_store()
+
+
+@_resource_cache
+def _get_llm_cached() -> ChatGoogleGenerativeAI:
+    """Gemini client, constructed once per process."""
+    return _get_llm()
+
+
+def warm_up() -> None:
+    """Load the benchmark collection and Gemini client ahead of the first report."""
+    _get_collection()
+    _get_llm_cached()
+
+
 # ── Step A3 + A4: Classification ─────────────────────────────────────────────
 
 def classify_lab_values(lab_values: list[dict]) -> list[dict]:
     """
-    For each lab value: query ChromaDB for normal range → classify → add Gemini reasoning.
+    For each lab value: look up the benchmark normal range → classify → add Gemini reasoning.
 
     Returns enriched list with status, risk metadata, and plain-language reason.
+    The input dicts are enriched in place (not copied).
     """
     logger.info("🔍 Loading vector store for benchmark lookup...")
-    collection = build_vector_store()
+    collection = _get_collection()
+
+    # One batched query for every test name instead of one query per row
+    names = [item.get("test", "").strip() for item in lab_values]
+    all_benchmarks = query_benchmarks_batch(collection, names, n_results=1)
+
+    # Classify every row at once: NaN marks a missing value or benchmark
+    benches = [benchmarks[0] if benchmarks else None for benchmarks in all_benchmarks]
+    numeric_values = [_parse_numeric(item.get("value", "N/A")) for item in lab_values]
+    values = np.array([np.nan if v is None else v for v in numeric_values], dtype=np.float64)
+    b_mins = np.array([np.nan if b is None else float(b["min"]) for b in benches], dtype=np.float64)
+    b_maxs = np.array([np.nan if b is None else float(b["max"]) for b in benches], dtype=np.float64)
+    statuses = _classify_many(values, b_mins, b_maxs)
+    deviations = _deviation_pct_many(values, b_mins, b_maxs)
 
     enriched = []
-    for item in lab_values:
-        test = item.get("test", "").strip()
-        raw_value = item.get("value", "N/A")
-        numeric_value = _parse_numeric(raw_value)
-
-        # Query benchmark
-        benchmarks = query_benchmark(collection, test, n_results=1)
-
-        if benchmarks and numeric_value is not None:
-            bench = benchmarks[0]
-            b_min = float(bench["min"])
-            b_max = float(bench["max"])
-            status = _classify(numeric_value, b_min, b_max)
+    for i, item in enumerate(lab_values):
+        status = str(statuses[i])
+        numeric_value = numeric_values[i]
+
+        if status != "UNKNOWN":
+            bench = benches[i]
             risk_meta = RISK_LEVELS[status]
 
-            enriched.append({
-                **item,
-                "numeric_value": numeric_value,
-                "status": status,
-                "risk_icon": risk_meta["icon"],
-                "risk_color": risk_meta["color"],
-                "risk_priority": risk_meta["priority"],
-                "benchmark_min": b_min,
-                "benchmark_max": b_max,
-                "benchmark_unit": bench.get("unit", ""),
-                "benchmark_description": bench.get("description", ""),
-                "deviation_pct": _deviation_pct(numeric_value, b_min, b_max),
-            })
+            item.update(
+                numeric_value=numeric_value,
+                status=status,
+                risk_icon=risk_meta["icon"],
+                risk_color=risk_meta["color"],
+                risk_priority=risk_meta["priority"],
+                benchmark_min=float(b_mins[i]),
+                benchmark_max=float(b_maxs[i]),
+                benchmark_unit=bench.get("unit", ""),
+                benchmark_description=bench.get("description", ""),
+                deviation_pct=round(float(deviations[i]), 1),
+            )
         else:
-            enriched.append({
-                **item,
-                "numeric_value": numeric_value,
-                "status": "UNKNOWN",
-                "risk_icon": RISK_LEVELS["UNKNOWN"]["icon"],
-                "risk_color": RISK_LEVELS["UNKNOWN"]["color"],
-                "risk_priority": 0,
-                "benchmark_min": None,
-                "benchmark_max": None,
-                "benchmark_unit": item.get("unit", ""),
-                "benchmark_description": "",
-                "deviation_pct": None,
-            })
+            item.update(
+                numeric_value=numeric_value,
+                status="UNKNOWN",
+                risk_icon=RISK_LEVELS["UNKNOWN"]["icon"],
+                risk_color=RISK_LEVELS["UNKNOWN"]["color"],
+                risk_priority=0,
+                benchmark_min=None,
+                benchmark_max=None,
+                benchmark_unit=item.get("unit", ""),
+                benchmark_description="",
+                deviation_pct=None,
+            )
+        enriched.append(item)
 
     # Sort: CRITICAL → HIGH → LOW → NORMAL → UNKNOWN
     enriched.sort(key=lambda x: x["risk_priority"], reverse=True)
@@ -116,25 +250,33 @@ def classify_lab_values(lab_values: list[dict]) -> list[dict]:
     return enriched
 
 
+# Columns the dashboard table renders, in display order
+CLASSIFIED_COLUMNS = (
+    "risk_icon", "test", "value", "unit", "status", "numeric_value",
+    "benchmark_min", "benchmark_max", "benchmark_unit", "deviation_pct",
+)
+
+
+def classified_columns(enriched: list[dict]) -> dict[str, list]:
+    """
+    Column-oriented view of classify_lab_values() output.
+    pd.DataFrame(columns) builds each column directly (numeric ones as float64)
+    instead of walking a list of dicts and inferring dtypes per row.
+    """
+    return {col: [item.get(col) for item in enriched] for col in CLASSIFIED_COLUMNS}
+
+
 # ── Step A5: Multilingual Summary ─────────────────────────────────────────────
 
-def generate_summary(
+def _summary_prompt(
     classified_values: list[dict],
     patient_info: dict,
-    language: str = "English",
-    raw_text: str = "",
-) -> dict:
-    """
-    Generate a rich, patient-friendly summary using Gemini.
-    Produces structured output with headline, findings, and recommendations.
-    """
-    llm = _get_llm()
+    language: str,
+    raw_text: str,
+) -> tuple[str, str]:
+    """Build the (system, prompt) pair for the patient summary."""
     lang_config = LANGUAGE_PROMPTS.get(language, LANGUAGE_PROMPTS["English"])
 
-    # Build findings context
-    abnormal = [v for v in classified_values if v["status"] in ("CRITICAL", "HIGH", "LOW")]
-    normal = [v for v in classified_values if v["status"] == "NORMAL"]
-
     if classified_values:
         findings_text = "\n".join([
             f"- {v['test']}: {v['value']} {v.get('unit','')} "
@@ -165,21 +307,43 @@ Your task — write a patient summary in exactly this structure:
 Be warm, clear, and reassuring. Do not use medical abbreviations without explanation.
 Length: 150-200 words total.
 """
+    return lang_config["system"], prompt
 
-    system_msg = lang_config["system"]
-    logger.info(f"🤖 Generating Gemini summary in {language}...")
 
-    response = llm.invoke([
-        SystemMessage(content=system_msg),
-        HumanMessage(content=prompt),
-    ])
-    summary_text = response.content.strip()
+def generate_summary(
+    classified_values: list[dict],
+    patient_info: dict,
+    language: str = "English",
+    raw_text: str = "",
+    include_summary: bool = True,
+) -> dict:
+    """
+    Generate a rich, patient-friendly summary using Gemini.
+    Produces structured output with headline, findings, and recommendations.
+    With include_summary=False only the critical explanations are generated
+    and "summary" is left empty (the caller streams it via stream_summary).
+    """
+    llm = _get_llm_cached()
 
-    # Gemini reasoning for critical values
-    critical_explanations = {}
+    abnormal = [v for v in classified_values if v["status"] in ("CRITICAL", "HIGH", "LOW")]
+    normal = [v for v in classified_values if v["status"] == "NORMAL"]
     critical_items = [v for v in classified_values if v["status"] == "CRITICAL"]
-    if critical_items:
-        critical_explanations = _generate_critical_explanations(llm, critical_items, language)
+
+    system_msg, prompt = _summary_prompt(classified_values, patient_info, language, raw_text)
+
+    # Headline summary and critical explanations share inputs but not outputs,
+    # so both Gemini round-trips run concurrently.
+    async def _summary_and_explanations():
+        critical_task = (
+            _generate_critical_explanations_async(llm, critical_items, language)
+            if critical_items else asyncio.sleep(0, result={})
+        )
+        if not include_summary:
+            return "", await critical_task
+        logger.info(f"🤖 Generating Gemini summary in {language}...")
+        return await asyncio.gather(_cached_ainvoke(llm, system_msg, prompt), critical_task)
+
+    summary_text, critical_explanations = _run_async(_summary_and_explanations())
 
     return {
         "summary": summary_text,
@@ -193,75 +357,195 @@ Length: 150-200 words total.
     }
 
 
-def _generate_critical_explanations(llm, critical_items: list[dict], language: str) -> dict:
-    """Generate a short plain-language explanation for each critical value."""
-    explanations = {}
+def stream_summary(
+    classified_values: list[dict],
+    patient_info: dict,
+    language: str = "English",
+    raw_text: str = "",
+) -> Iterator[str]:
+    """
+    Yield the patient summary as Gemini produces it (for st.write_stream).
+    Shares the response cache with generate_summary, so a repeat is one chunk.
+    """
+    llm = _get_llm_cached()
+    system_msg, prompt = _summary_prompt(classified_values, patient_info, language, raw_text)
+    key = (system_msg, prompt, getattr(llm, "model", ""))
+
+    cached = _llm_cache_get(key)
+    if cached is not None:
+        yield cached
+        return
+
+    logger.info(f"🤖 Streaming Gemini summary in {language}...")
+    chunks = []
+    for chunk in llm.stream([
+        SystemMessage(content=system_msg),
+        HumanMessage(content=prompt),
+    ]):
+        if chunk.content:
+            chunks.append(chunk.content)
+            yield chunk.content
+
+    _llm_cache_put(key, "".join(chunks).strip())
+
+
+async def _generate_critical_explanations_async(llm, critical_items: list[dict], language: str) -> dict:
+    """
+    Generate a short plain-language explanation for each critical value.
+    All Gemini calls are fired concurrently, so K items cost ~1 round-trip.
+    """
     lang_config = LANGUAGE_PROMPTS.get(language, LANGUAGE_PROMPTS["English"])
 
-    for item in critical_items:
-        prompt = (
+    def prompt_for(item: dict) -> str:
+        return (
             f"The patient's {item['test']} is {item['value']} {item.get('unit','')}. "
             f"Normal range is {item['benchmark_min']}–{item['benchmark_max']} {item['benchmark_unit']}. "
             f"In 1-2 simple sentences, explain what this means for the patient and why it's urgent. "
             f"{lang_config['instruction']}"
         )
-        try:
-            resp = llm.invoke([
-                SystemMessage(content=lang_config["system"]),
-                HumanMessage(content=prompt),
-            ])
-            explanations[item["test"]] = resp.content.strip()
-        except Exception as e:
-            logger.warning(f"Could not generate explanation for {item['test']}: {e}")
+
+    tasks = [
+        _cached_ainvoke(llm, lang_config["system"], prompt_for(item))
+        for item in critical_items
+    ]
+    responses = await asyncio.gather(*tasks, return_exceptions=True)
+
+    explanations = {}
+    for item, resp in zip(critical_items, responses):
+        if isinstance(resp, Exception):
+            logger.warning(f"Could not generate explanation for {item['test']}: {resp}")
             explanations[item["test"]] = item.get("benchmark_description", "")
+        else:
+            explanations[item["test"]] = resp
 
     return explanations
 
 
+def _run_async(coro):
+    """Run a coroutine from sync code, even when called inside a running event loop."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(asyncio.run, coro).result()
+
+
 # ── Master Pipeline ───────────────────────────────────────────────────────────
 
-def run_full_pipeline(pdf_path: str, language: str = "English") -> dict:
+def parse_and_classify(pdf_path: str | BinaryIO) -> dict:
     """
-    Master pipeline: PDF → parse → classify → summarise → voice-ready output.
-    Returns complete dict ready for Streamlit + FastAPI.
+    Steps A1–A4: parse the PDF and classify every value.
+    Nothing here depends on the output language, so a language switch can
+    reuse this result and only redo summarize().
     """
     from lab_report.pdf_parser import extract_lab_values
 
-    logger.info(f"🔬 Starting full pipeline | file={pdf_path} | lang={language}")
-
     # A1: Parse
     parsed = extract_lab_values(pdf_path)
 
     # A3–A4: Classify
-    classified = classify_lab_values(parsed["lab_values"])
+    return _analysis(parsed, classify_lab_values(parsed["lab_values"]))
+
+
+def classify_reports(parsed_reports: list[dict]) -> list[dict]:
+    """
+    Steps A3–A4 for several extract_lab_values() results at once: every
+    report's rows share one benchmark lookup and one classification pass.
+    Returns one parse_and_classify()-shaped dict per report, in input order.
+    """
+    reports = [parsed["lab_values"] for parsed in parsed_reports]
+    classify_lab_values([item for lab_values in reports for item in lab_values])
 
-    # A5: Summarise
-    summary = generate_summary(classified, parsed["patient_info"], language, raw_text=parsed.get("raw_text", ""))
+    # Rows were enriched in place; only the per-report ordering is left
+    return [
+        _analysis(parsed, sorted(lab_values, key=lambda x: x["risk_priority"], reverse=True))
+        for parsed, lab_values in zip(parsed_reports, reports)
+    ]
 
+
+def _analysis(parsed: dict, classified: list[dict]) -> dict:
     return {
         "patient_info": parsed["patient_info"],
         "classified_values": classified,
+        "raw_text": parsed.get("raw_text", ""),
+        "extraction_method": parsed.get("extraction_method", "unknown"),
+        "pages": parsed.get("pages", 1),
+    }
+
+
+def summarize(analysis: dict, language: str = "English", include_summary: bool = True) -> dict:
+    """
+    Step A5 on top of parse_and_classify() output → the full pipeline result.
+    With include_summary=False the summary is left empty and "raw_text" is
+    returned so the UI can stream it with stream_summary().
+    """
+    classified = analysis["classified_values"]
+    summary = generate_summary(
+        classified, analysis["patient_info"], language,
+        raw_text=analysis["raw_text"], include_summary=include_summary,
+    )
+
+    result = {
+        "patient_info": analysis["patient_info"],
+        "classified_values": classified,
         "summary": summary["summary"],
         "critical_flags": summary["critical_flags"],
         "critical_explanations": summary.get("critical_explanations", {}),
         "language": language,
-        "extraction_method": parsed.get("extraction_method", "unknown"),
+        "extraction_method": analysis["extraction_method"],
         "stats": {
             "total":    summary["total_tests"],
             "normal":   summary["normal_count"],
             "abnormal": summary["abnormal_count"],
             "critical": summary["critical_count"],
-            "pages":    parsed.get("pages", 1),
+            "pages":    analysis["pages"],
         },
     }
+    if not include_summary:
+        result["raw_text"] = analysis["raw_text"]
+    return result
+
+
+def run_full_pipeline(
+    pdf_path: str | BinaryIO,
+    language: str = "English",
+    include_summary: bool = True,
+) -> dict:
+    """
+    Master pipeline: PDF → parse → classify → summarise → voice-ready output.
+    Accepts a file path or an in-memory binary stream.
+    Returns complete dict ready for Streamlit + FastAPI.
+    """
+    logger.info(f"🔬 Starting full pipeline | file={pdf_path} | lang={language}")
+    return summarize(parse_and_classify(pdf_path), language, include_summary=include_summary)
+
+
+@_pipeline_cache
+def parse_and_classify_cached(pdf_bytes: bytes) -> dict:
+    """
+    parse_and_classify memoised on the PDF content, for the dashboard.
+    Also caches "classified_columns", the column layout its results table is
+    built from; API responses leave it out rather than repeat every value.
+    """
+    analysis = parse_and_classify(io.BytesIO(pdf_bytes))
+    return {**analysis, "classified_columns": classified_columns(analysis["classified_values"])}
 
 
 # ── Helpers ───────────────────────────────────────────────────────────────────
 
+_NUM_RE = re.compile(r"\d+\.?\d*")
+
+
 def _parse_numeric(value: str) -> float | None:
     if not value:
         return None
-    match = re.search(r"[\d]+\.?[\d]*", str(value).replace(",", ""))
+    text = str(value).replace(",", "")
+    # Fast path for clean values like "13.5"; the guard keeps float() from
+    # accepting "nan", "1e5", "-3" etc. that the regex would read differently.
+    if text.replace(".", "", 1).isdigit() and text.isascii():
+        return float(text)
+    match = _NUM_RE.search(text)
     return float(match.group()) if match else None
 
 
@@ -275,6 +559,30 @@ def _classify(value: float, b_min: float, b_max: float) -> str:
     return "NORMAL"
 
 
+# Status per _classify_many code; 0 = no numeric value or no benchmark
+_STATUS_BY_CODE = np.array(["UNKNOWN", "NORMAL", "LOW", "HIGH", "CRITICAL"])
+
+
+def _classify_many(values: np.ndarray, b_min: np.ndarray, b_max: np.ndarray) -> np.ndarray:
+    """Vectorised _classify; rows with any NaN input come back UNKNOWN."""
+    unknown = np.isnan(values) | np.isnan(b_min) | np.isnan(b_max)
+    codes = np.select(
+        [unknown, (values < b_min * 0.65) | (values > b_max * 1.6), values < b_min, values > b_max],
+        [0, 4, 2, 3],
+        default=1,
+    )
+    return _STATUS_BY_CODE[codes]
+
+
+def _deviation_pct_many(values: np.ndarray, b_min: np.ndarray, b_max: np.ndarray) -> np.ndarray:
+    """Vectorised _deviation_pct, unrounded (NaN where inputs are missing)."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(
+            values < b_min, (b_min - values) / b_min * 100,
+            np.where(values > b_max, (values - b_max) / b_max * 100, 0.0),
+        )
+
+
 def _deviation_pct(value: float, b_min: float, b_max: float) -> float | None:
     """How far outside normal range (%) — 0 if normal."""
     if value < b_min:
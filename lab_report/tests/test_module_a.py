@@ -4,69 +4,105 @@ Unit tests for pdf_parser, vector_store, rag_pipeline, and voice modules.
 Run with: pytest lab_report/tests/ -v
 """
 
+import numpy as np
 import pytest
 from unittest.mock import patch, MagicMock
 from pathlib import Path
 
+from lab_report.pdf_parser import extract_lab_values, _extract_patient_info, _parse_lab_table
+from lab_report.rag_pipeline import (
+    CLASSIFIED_COLUMNS,
+    _classify,
+    _classify_many,
+    _parse_numeric,
+    classified_columns,
+    classify_lab_values,
+)
+from lab_report.vector_store import (
+    MEDICAL_BENCHMARKS,
+    build_vector_store,
+    lookup_benchmark,
+    query_benchmark,
+    query_benchmarks_batch,
+)
+from lab_report.vector_store_np import BenchmarkIndex
+from lab_report.voice import LANGUAGE_CODES, generate_audio
+
 
 # ── PDF Parser Tests ──────────────────────────────────────────────────────────
 
 class TestPDFParser:
     def test_file_not_found(self):
-        from lab_report.pdf_parser import extract_lab_values
         with pytest.raises(FileNotFoundError):
             extract_lab_values("/nonexistent/report.pdf")
 
     def test_parse_numeric_value(self):
-        from lab_report.rag_pipeline import _parse_numeric
         assert _parse_numeric("13.5") == 13.5
         assert _parse_numeric("13.5 g/dL") == 13.5
         assert _parse_numeric("N/A") is None
         assert _parse_numeric("") is None
 
     def test_extract_patient_info(self):
-        from lab_report.pdf_parser import _extract_patient_info
         text = "Patient Name: Rajesh Kumar\nAge: 45 Yrs\nDate: 27/02/2026"
         info = _extract_patient_info(text)
         assert info["age"] == "45"
         assert "27/02/2026" in info["date"]
 
+    def test_partial_header_keeps_positional_columns(self):
+        table = [
+            ["Parameter", "Value", "Unit", "Ref"],
+            ["Glucose", "90", "mg/dL", "70-100", "H"],
+        ]
+        row = _parse_lab_table(table)[0]
+        assert row["test"] == "Glucose"
+        assert row["reference"] == "70-100"
+        assert row["status"] == "H"
+
 
 # ── Classification Tests ──────────────────────────────────────────────────────
 
 class TestClassification:
     def test_normal_classification(self):
-        from lab_report.rag_pipeline import _classify
         assert _classify(14.0, 13.0, 17.0) == "NORMAL"
 
     def test_high_classification(self):
-        from lab_report.rag_pipeline import _classify
         assert _classify(18.0, 13.0, 17.0) == "HIGH"
 
     def test_low_classification(self):
-        from lab_report.rag_pipeline import _classify
         assert _classify(10.0, 13.0, 17.0) == "LOW"
 
     def test_critical_very_high(self):
-        from lab_report.rag_pipeline import _classify
         # > 1.5x max → CRITICAL
         assert _classify(30.0, 13.0, 17.0) == "CRITICAL"
 
     def test_critical_very_low(self):
-        from lab_report.rag_pipeline import _classify
         # < 0.7x min → CRITICAL
         assert _classify(5.0, 13.0, 17.0) == "CRITICAL"
 
+    def test_classify_many_matches_scalar(self):
+        values = np.array([14.0, 18.0, 10.0, 30.0, 5.0, np.nan])
+        statuses = _classify_many(values, np.full(6, 13.0), np.full(6, 17.0))
+        assert list(statuses[:5]) == [_classify(v, 13.0, 17.0) for v in values[:5]]
+        assert statuses[5] == "UNKNOWN"
+
+    def test_classified_columns_preserve_row_order(self):
+        rows = [
+            {"test": "TSH", "status": "HIGH", "benchmark_min": 0.4},
+            {"test": "Hemoglobin", "status": "UNKNOWN", "benchmark_min": None},
+        ]
+        cols = classified_columns(rows)
+        assert tuple(cols) == CLASSIFIED_COLUMNS
+        assert cols["test"] == ["TSH", "Hemoglobin"]
+        assert cols["benchmark_min"] == [0.4, None]
+
 
 # ── Vector Store Tests ────────────────────────────────────────────────────────
 
 class TestVectorStore:
     def test_benchmark_data_not_empty(self):
-        from lab_report.vector_store import MEDICAL_BENCHMARKS
         assert len(MEDICAL_BENCHMARKS) > 10
 
     def test_benchmark_structure(self):
-        from lab_report.vector_store import MEDICAL_BENCHMARKS
         for bench in MEDICAL_BENCHMARKS:
             assert "test" in bench
             assert "min" in bench
@@ -75,19 +111,58 @@ class TestVectorStore:
             assert bench["min"] <= bench["max"], f"Invalid range for {bench['test']}"
 
     def test_build_vector_store_creates_collection(self, tmp_path):
-        from lab_report.vector_store import build_vector_store
         collection = build_vector_store(persist_path=str(tmp_path / "test_chroma"))
         assert collection is not None
         assert collection.count() > 0
 
     def test_query_hemoglobin(self, tmp_path):
-        from lab_report.vector_store import build_vector_store, query_benchmark
         collection = build_vector_store(persist_path=str(tmp_path / "test_chroma"))
         results = query_benchmark(collection, "Hemoglobin")
         assert len(results) > 0
         assert "min" in results[0]
         assert "max" in results[0]
 
+    def test_query_benchmarks_batch_single_query(self):
+        collection = MagicMock()
+        collection.count.return_value = 5
+        collection.query.return_value = {
+            "metadatas": [[{"test": "ferritin"}], [{"test": "vitamin d"}]]
+        }
+        results = query_benchmarks_batch(collection, ["Ferritin", "Hemoglobin", "Vitamin D"])
+        collection.query.assert_called_once()
+        assert collection.query.call_args.kwargs["query_texts"] == ["Ferritin", "Vitamin D"]
+        assert [r[0]["test"] for r in results] == ["ferritin", "hemoglobin", "vitamin d"]
+
+    def test_query_benchmarks_batch_dedupes_misses(self):
+        collection = MagicMock()
+        collection.count.return_value = 5
+        collection.query.return_value = {"metadatas": [[{"test": "ferritin"}]]}
+        results = query_benchmarks_batch(collection, ["Ferritin", "TSH", "Ferritin"])
+        assert collection.query.call_args.kwargs["query_texts"] == ["Ferritin"]
+        assert [r[0]["test"] for r in results] == ["ferritin", "tsh", "ferritin"]
+
+    def test_numpy_index_ranks_by_cosine(self):
+        metadatas = [{"test": "a"}, {"test": "b"}, {"test": "c"}]
+        index = BenchmarkIndex(
+            [[1.0, 0.0], [0.0, 2.0], [1.0, 1.0]], metadatas,
+            embedding_function=lambda texts: [[0.0, 1.0] for _ in texts],
+        )
+        results = index.query(query_texts=["x", "y"], n_results=2)
+        assert [m["test"] for m in results["metadatas"][0]] == ["b", "c"]
+        assert len(results["metadatas"]) == 2
+
+    def test_known_names_skip_chroma(self):
+        collection = MagicMock()
+        results = query_benchmark(collection, "  Haemoglobin ")
+        collection.query.assert_not_called()
+        assert results[0]["test"] == "hemoglobin"
+        assert results[0]["min"] <= results[0]["max"]
+
+    def test_lookup_ignores_spacing_and_punctuation(self):
+        for name in ("HbA1c", "HBA1C", "Hb A1c", "Hb-A1c", "Hemoglobin A1c"):
+            assert lookup_benchmark(name)[0]["test"] == "hba1c"
+        assert lookup_benchmark("VLDL Cholesterol") is None
+
 
 # ── Voice Tests ───────────────────────────────────────────────────────────────
 
@@ -97,7 +172,6 @@ class TestVoice:
         mock_instance = MagicMock()
         mock_gtts.return_value = mock_instance
 
-        from lab_report.voice import generate_audio
         output = generate_audio("Test summary", "English", str(tmp_path / "test.mp3"))
 
         mock_gtts.assert_called_once_with(text="Test summary", lang="en", slow=False)
@@ -108,12 +182,10 @@ class TestVoice:
         mock_instance = MagicMock()
         mock_gtts.return_value = mock_instance
 
-        from lab_report.voice import generate_audio
         generate_audio("परीक्षण", "Hindi", str(tmp_path / "test_hi.mp3"))
         mock_gtts.assert_called_with(text="परीक्षण", lang="hi", slow=False)
 
     def test_language_codes_complete(self):
-        from lab_report.voice import LANGUAGE_CODES
         assert "English" in LANGUAGE_CODES
         assert "Telugu" in LANGUAGE_CODES
         assert "Hindi" in LANGUAGE_CODES
@@ -124,25 +196,32 @@ class TestVoice:
 class TestIntegration:
     def test_classify_lab_values_with_mock_data(self, tmp_path):
         """Test the classify step with synthetic lab values."""
-        from lab_report.rag_pipeline import classify_lab_values
-        from unittest.mock import patch
 
         sample_values = [
             {"test": "Hemoglobin", "value": "10.5", "unit": "g/dL", "reference": "13-17"},
             {"test": "Platelets", "value": "200", "unit": "10³/µL", "reference": "150-400"},
             {"test": "TSH", "value": "8.5", "unit": "µIU/mL", "reference": "0.4-4.0"},
+            {"test": "Serum Zinc Level", "value": "20.0", "unit": "µmol/L", "reference": ""},
         ]
 
-        with patch("lab_report.rag_pipeline.build_vector_store") as mock_store:
+        # The collection is process-cached, so patch the accessor itself
+        with patch("lab_report.rag_pipeline._get_collection") as mock_get_collection:
             mock_collection = MagicMock()
             mock_collection.count.return_value = 5
             mock_collection.query.return_value = {
                 "metadatas": [[{"min": 13.0, "max": 17.0, "unit": "g/dL", "description": "test"}]]
             }
-            mock_store.return_value = mock_collection
+            mock_get_collection.return_value = mock_collection
 
             result = classify_lab_values(sample_values)
-            assert len(result) == 3
-            for r in result:
-                assert "status" in r
-                assert "risk_icon" in r
+
+        # Known names come from the in-process table; only the unknown one is queried
+        mock_collection.query.assert_called_once()
+        assert mock_collection.query.call_args.kwargs["query_texts"] == ["Serum Zinc Level"]
+        assert len(result) == 4
+        for r in result:
+            assert "status" in r
+            assert "risk_icon" in r
+        zinc = next(r for r in result if r["test"] == "Serum Zinc Level")
+        assert zinc["benchmark_min"] == 13.0
+        assert zinc["status"] == "HIGH"
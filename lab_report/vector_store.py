@@ -5,18 +5,36 @@ Builds and queries the medical benchmark RAG database.
 Normal ranges sourced from standard clinical references.
 """
 
+import hashlib
 import json
-import chromadb
-from chromadb.utils import embedding_functions
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+import numpy as np
 from pathlib import Path
 from scripts.logger import get_logger
 from scripts.config import config
 
+try:
+    import chromadb
+    from chromadb.api.types import EmbeddingFunction
+except ImportError:  # the NumPy backend (vector_store_np) works without ChromaDB
+    chromadb = None
+    EmbeddingFunction = object
+
 logger = get_logger("lab_report.vector_store")
 
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"  # Fast, lightweight, good accuracy
+
+# Precomputed MiniLM embeddings of the benchmark documents, generated with
+# scripts/build_vector_store.py. Lets a fresh deploy populate the
+# collection without downloading or running the model.
+BENCHMARK_EMBEDDINGS_PATH = Path(__file__).parent / "data" / "benchmarks_emb.npz"
+
 # ── Embedded Medical Benchmark Data ───────────────────────────────────────────
 # Format: test_name → {min, max, unit, description}
-MEDICAL_BENCHMARKS = [
+MEDICAL_BENCHMARKS = (
     # Complete Blood Count (CBC)
     {"test": "Hemoglobin", "min": 13.0, "max": 17.0, "unit": "g/dL", "gender": "male", "description": "Oxygen-carrying protein in red blood cells. Low values indicate anemia."},
     {"test": "Hemoglobin", "min": 12.0, "max": 15.5, "unit": "g/dL", "gender": "female", "description": "Oxygen-carrying protein in red blood cells. Low values indicate anemia."},
@@ -53,10 +71,171 @@ MEDICAL_BENCHMARKS = [
     {"test": "TSH", "min": 0.4, "max": 4.0, "unit": "µIU/mL", "gender": "all", "description": "Thyroid-stimulating hormone. Low TSH = overactive thyroid; high TSH = underactive thyroid."},
     {"test": "T3", "min": 80.0, "max": 200.0, "unit": "ng/dL", "gender": "all", "description": "Triiodothyronine — active thyroid hormone affecting metabolism."},
     {"test": "T4", "min": 5.0, "max": 12.0, "unit": "µg/dL", "gender": "all", "description": "Thyroxine — main thyroid hormone controlling metabolism."},
-]
+)
+
+
+# Common report spellings → benchmark test name (lowercase)
+TEST_ALIASES = {
+    "haemoglobin": "hemoglobin",
+    "hb": "hemoglobin",
+    "total leucocyte count": "wbc",
+    "total leukocyte count": "wbc",
+    "tlc": "wbc",
+    "wbc count": "wbc",
+    "platelet count": "platelets",
+    "rbc count": "rbc",
+    "pcv": "hematocrit",
+    "packed cell volume": "hematocrit",
+    "alanine aminotransferase": "alt",
+    "aspartate aminotransferase": "ast",
+    "total bilirubin": "bilirubin total",
+    "serum creatinine": "creatinine",
+    "glycated hemoglobin": "hba1c",
+    "glycosylated hemoglobin": "hba1c",
+    "hemoglobin a1c": "hba1c",
+    "fbs": "fasting blood glucose",
+    "glucose fasting": "fasting blood glucose",
+    "ppbs": "post prandial glucose",
+    "triglyceride": "triglycerides",
+    "serum uric acid": "uric acid",
+    "thyroid stimulating hormone": "tsh",
+}
+
+
+def _benchmark_metadata(bench: dict) -> dict:
+    """Metadata stored (and returned by queries) for one benchmark row."""
+    return {
+        "test": bench["test"].lower(),
+        "min": bench["min"],
+        "max": bench["max"],
+        "unit": bench["unit"],
+        "gender": bench.get("gender", "all"),
+        "description": bench["description"],
+    }
+
+
+_NON_ALNUM_RE = re.compile(r"[^a-z0-9]+")
+
+
+def _normalise_test_name(test_name: str) -> str:
+    """Case, space and punctuation-insensitive key: "Hb A1c" / "HBA1C" → "hba1c"."""
+    return _NON_ALNUM_RE.sub("", test_name.lower())
+
+
+# Metadata and embedding text per row, materialised once at import; the
+# name index, collection population and the NumPy index all reuse them.
+_BENCHMARK_METADATA: tuple[dict, ...] = tuple(map(_benchmark_metadata, MEDICAL_BENCHMARKS))
+_BENCHMARK_DOCUMENTS: tuple[str, ...] = tuple(
+    f"{bench['test']} normal range is {bench['min']} to {bench['max']} {bench['unit']}. "
+    f"{bench['description']}"
+    for bench in MEDICAL_BENCHMARKS
+)
+_BENCHMARK_IDS: tuple[str, ...] = tuple(f"bench_{i:03d}" for i in range(len(MEDICAL_BENCHMARKS)))
+
+# Exact-name index over MEDICAL_BENCHMARKS: known names skip the embedding
+# model and ANN query entirely; only unfamiliar names go to ChromaDB.
+_BENCH_BY_NAME: dict[str, list[dict]] = {}
+for _meta in _BENCHMARK_METADATA:
+    _BENCH_BY_NAME.setdefault(_normalise_test_name(_meta["test"]), []).append(_meta)
+for _alias, _name in TEST_ALIASES.items():
+    _BENCH_BY_NAME.setdefault(_normalise_test_name(_alias), _BENCH_BY_NAME[_normalise_test_name(_name)])
+
+
+def lookup_benchmark(test_name: str, n_results: int = 3) -> list[dict] | None:
+    """Exact (or alias) match against MEDICAL_BENCHMARKS; None when unknown."""
+    hits = _BENCH_BY_NAME.get(_normalise_test_name(test_name))
+    if hits is None:
+        return None
+    return [dict(meta) for meta in hits[:n_results]]
+
+
+class CachedEmbeddingFunction(EmbeddingFunction):
+    """
+    SentenceTransformer embeddings memoised per text: an in-process LRU first,
+    then a SQLite table that survives restarts and is shared across processes.
+    Only texts missing from both reach the model, which is loaded on first miss.
+    """
+
+    def __init__(self, model_name: str, cache_path: str, capacity: int = 1024, **kwargs):
+        self._model_name = model_name
+        self._model_kwargs = kwargs
+        self._model = None
+        self._cache_path = cache_path
+        self._capacity = capacity
+        self._lru: OrderedDict[str, list[float]] = OrderedDict()
+        self._lock = threading.Lock()
+        with sqlite3.connect(self._cache_path) as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS emb_cache (hash TEXT PRIMARY KEY, vec BLOB)")
+
+    def _embed(self, texts: list[str]) -> list:
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+            logger.info(f"Loading embedding model: {self._model_name}")
+            self._model = SentenceTransformer(self._model_name, **self._model_kwargs)
+        return self._model.encode(list(texts), convert_to_numpy=True).tolist()
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self._model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def __call__(self, input):
+        keys = [self._key(text) for text in input]
+        out: list[list[float] | None] = [None] * len(keys)
+
+        # Layer 1: in-process LRU
+        with self._lock:
+            for i, key in enumerate(keys):
+                vec = self._lru.get(key)
+                if vec is not None:
+                    self._lru.move_to_end(key)
+                    out[i] = vec
+        missing = [i for i, vec in enumerate(out) if vec is None]
+
+        # Layer 2: SQLite
+        if missing:
+            with sqlite3.connect(self._cache_path) as conn:
+                rows = dict(conn.execute(
+                    f"SELECT hash, vec FROM emb_cache WHERE hash IN ({','.join('?' * len(missing))})",
+                    [keys[i] for i in missing],
+                ))
+            for i in missing:
+                blob = rows.get(keys[i])
+                if blob is not None:
+                    out[i] = np.frombuffer(blob, dtype=np.float32).tolist()
+            missing = [i for i in missing if out[i] is None]
+
+        # Miss: one batched forward pass, written back to SQLite
+        if missing:
+            computed = self._embed([input[i] for i in missing])
+            with sqlite3.connect(self._cache_path) as conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO emb_cache (hash, vec) VALUES (?, ?)",
+                    [(keys[i], np.asarray(vec, dtype=np.float32).tobytes()) for i, vec in zip(missing, computed)],
+                )
+            for i, vec in zip(missing, computed):
+                out[i] = list(vec)
+
+        with self._lock:
+            for key, vec in zip(keys, out):
+                self._lru[key] = vec
+                self._lru.move_to_end(key)
+            while len(self._lru) > self._capacity:
+                self._lru.popitem(last=False)
+
+        return out
+
 
+# HNSW index settings, applied when the collection is first created.
+# MiniLM embeddings are unit-normalised, so cosine ranks exactly like the
+# default l2 while skipping the norm terms in the distance.
+HNSW_CONFIG = {
+    "hnsw:space": "cosine",
+    "hnsw:construction_ef": 200,
+    "hnsw:M": 32,
+    "hnsw:search_ef": 50,
+}
 
-def build_vector_store(persist_path: str | None = None) -> chromadb.Collection:
+
+def build_vector_store(persist_path: str | None = None) -> "chromadb.Collection":
     """
     Build or load the ChromaDB vector store with medical benchmarks.
 
@@ -66,6 +245,9 @@ def build_vector_store(persist_path: str | None = None) -> chromadb.Collection:
     Returns:
         ChromaDB collection ready for querying.
     """
+    if chromadb is None:
+        raise ImportError("chromadb is not installed — use lab_report.vector_store_np instead")
+
     db_path = persist_path or config.CHROMA_DB_PATH
     Path(db_path).mkdir(parents=True, exist_ok=True)
 
@@ -73,22 +255,23 @@ def build_vector_store(persist_path: str | None = None) -> chromadb.Collection:
 
     client = chromadb.PersistentClient(path=db_path)
 
-    # Use HuggingFace sentence-transformers for embeddings
-    ef = embedding_functions.SentenceTransformerEmbeddingFunction(
-        model_name="all-MiniLM-L6-v2"  # Fast, lightweight, good accuracy
+    # Use HuggingFace sentence-transformers for embeddings, cached per text
+    ef = CachedEmbeddingFunction(
+        model_name=EMBEDDING_MODEL,
+        cache_path=str(Path(db_path) / "embedding_cache.sqlite3"),
     )
 
     # Get or create collection
     collection = client.get_or_create_collection(
         name="medical_benchmarks",
         embedding_function=ef,
-        metadata={"description": "Lab test normal ranges and clinical descriptions"},
+        metadata={"description": "Lab test normal ranges and clinical descriptions", **HNSW_CONFIG},
     )
 
     # Only populate if empty
     if collection.count() == 0:
         logger.info("Populating vector store with medical benchmarks...")
-        _populate_collection(collection)
+        _populate_collection(collection, ef)
         logger.info(f"✅ Loaded {collection.count()} benchmark documents")
     else:
         logger.info(f"Vector store already populated with {collection.count()} documents")
@@ -96,31 +279,59 @@ def build_vector_store(persist_path: str | None = None) -> chromadb.Collection:
     return collection
 
 
-def _populate_collection(collection: chromadb.Collection):
-    """Insert all benchmark records into ChromaDB."""
-    documents, metadatas, ids = [], [], []
+def _benchmark_documents() -> tuple[list[str], list[dict], list[str]]:
+    """(documents, metadatas, ids) for every MEDICAL_BENCHMARKS row."""
+    return list(_BENCHMARK_DOCUMENTS), list(map(dict, _BENCHMARK_METADATA)), list(_BENCHMARK_IDS)
+
+
+def _documents_digest(documents: list[str]) -> str:
+    """Fingerprint of model + document texts; a stale embeddings file won't match."""
+    return hashlib.sha256("\0".join([EMBEDDING_MODEL, *documents]).encode("utf-8")).hexdigest()
 
-    for i, bench in enumerate(MEDICAL_BENCHMARKS):
-        # Document text used for embedding / semantic search
-        doc_text = (
-            f"{bench['test']} normal range is {bench['min']} to {bench['max']} {bench['unit']}. "
-            f"{bench['description']}"
-        )
-        documents.append(doc_text)
-        metadatas.append({
-            "test": bench["test"].lower(),
-            "min": bench["min"],
-            "max": bench["max"],
-            "unit": bench["unit"],
-            "gender": bench.get("gender", "all"),
-            "description": bench["description"],
-        })
-        ids.append(f"bench_{i:03d}")
 
-    collection.add(documents=documents, metadatas=metadatas, ids=ids)
+def _load_precomputed_embeddings(documents: list[str]) -> list | None:
+    """Embeddings from BENCHMARK_EMBEDDINGS_PATH, or None if missing or stale."""
+    if not BENCHMARK_EMBEDDINGS_PATH.exists():
+        return None
+    with np.load(BENCHMARK_EMBEDDINGS_PATH) as data:
+        if str(data["digest"]) != _documents_digest(documents):
+            logger.warning("Precomputed benchmark embeddings are stale — re-embedding")
+            return None
+        return data["embeddings"].astype(np.float32).tolist()
 
 
-def query_benchmark(collection: chromadb.Collection, test_name: str, n_results: int = 3) -> list[dict]:
+def export_benchmark_embeddings(path: Path = BENCHMARK_EMBEDDINGS_PATH) -> Path:
+    """Embed the benchmark documents once and save them for _populate_collection."""
+    documents, _, _ = _benchmark_documents()
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer(EMBEDDING_MODEL)
+    embeddings = model.encode(documents, batch_size=32, convert_to_numpy=True).astype(np.float32)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    np.savez(path, embeddings=embeddings, digest=np.array(_documents_digest(documents)))
+    logger.info(f"✅ Saved {embeddings.shape} benchmark embeddings to {path}")
+    return path
+
+
+def _populate_collection(collection: "chromadb.Collection", ef=None):
+    """
+    Insert all benchmark records into ChromaDB.
+    Embeddings come from the precomputed asset when it is current; otherwise,
+    when `ef` is given, documents are embedded up front in one batch (through
+    its cache). Either way the collection does no embedding work itself.
+    """
+    documents, metadatas, ids = _benchmark_documents()
+
+    embeddings = _load_precomputed_embeddings(documents)
+    if embeddings is None and ef is not None:
+        embeddings = ef(documents)
+
+    if embeddings is not None:
+        collection.add(documents=documents, embeddings=embeddings, metadatas=metadatas, ids=ids)
+    else:
+        collection.add(documents=documents, metadatas=metadatas, ids=ids)
+
+
+def query_benchmark(collection: "chromadb.Collection", test_name: str, n_results: int = 3) -> list[dict]:
     """
     Retrieve normal range benchmarks for a given lab test name.
 
@@ -132,6 +343,10 @@ def query_benchmark(collection: chromadb.Collection, test_name: str, n_results:
     Returns:
         List of benchmark dicts with min, max, unit, description.
     """
+    hits = lookup_benchmark(test_name, n_results)
+    if hits is not None:
+        return hits
+
     results = collection.query(
         query_texts=[test_name],
         n_results=min(n_results, collection.count()),
@@ -143,3 +358,42 @@ def query_benchmark(collection: chromadb.Collection, test_name: str, n_results:
             benchmarks.append(meta)
 
     return benchmarks
+
+
+def query_benchmarks_batch(
+    collection: "chromadb.Collection", test_names: list[str], n_results: int = 1
+) -> list[list[dict]]:
+    """
+    Retrieve benchmarks for many lab test names in a single ChromaDB query.
+
+    Known names are answered from the in-process index; the rest go to
+    Chroma in one query (one embedding forward pass for all of them), with
+    repeated names queried once.
+
+    Args:
+        collection: ChromaDB collection.
+        test_names: Lab test names, e.g. ["Hemoglobin", "TSH"].
+        n_results: Max number of matching benchmarks per name.
+
+    Returns:
+        One list of benchmark dicts per input name, in input order.
+    """
+    if not test_names:
+        return []
+
+    out = [lookup_benchmark(name, n_results) for name in test_names]
+    misses = [i for i, hit in enumerate(out) if hit is None]
+    if not misses:
+        return out
+
+    unique = list(dict.fromkeys(test_names[i] for i in misses))
+    results = collection.query(
+        query_texts=unique,
+        n_results=min(n_results, collection.count()),
+    )
+
+    metadatas = (results or {}).get("metadatas") or []
+    by_name = {name: metadatas[j] if j < len(metadatas) else [] for j, name in enumerate(unique)}
+    for i in misses:
+        out[i] = list(by_name[test_names[i]])
+    return out
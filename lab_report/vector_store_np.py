@@ -0,0 +1,93 @@
+"""
+MedAgent 360 · Module A · Step A2 (NumPy backend)
+In-memory benchmark store: one float32 matrix + cosine similarity.
+Same public API as vector_store, without ChromaDB — for ~30 static
+benchmarks an HNSW index and SQLite persistence only add overhead.
+"""
+
+import numpy as np
+from pathlib import Path
+from lab_report.vector_store import (
+    MEDICAL_BENCHMARKS,
+    EMBEDDING_MODEL,
+    CachedEmbeddingFunction,
+    lookup_benchmark,
+    query_benchmark,
+    query_benchmarks_batch,
+    _benchmark_documents,
+    _load_precomputed_embeddings,
+)
+from scripts.logger import get_logger
+from scripts.config import config
+
+logger = get_logger("lab_report.vector_store_np")
+
+__all__ = [
+    "MEDICAL_BENCHMARKS",
+    "BenchmarkIndex",
+    "build_vector_store",
+    "lookup_benchmark",
+    "query_benchmark",
+    "query_benchmarks_batch",
+]
+
+
+class BenchmarkIndex:
+    """
+    Unit-normalised benchmark embeddings searched by a single matrix product.
+    Exposes the count()/query() subset of a Chroma collection that
+    query_benchmark and query_benchmarks_batch rely on.
+    """
+
+    def __init__(self, embeddings, metadatas: list[dict], embedding_function):
+        emb = np.asarray(embeddings, dtype=np.float32)
+        self._emb = emb / np.maximum(np.linalg.norm(emb, axis=1, keepdims=True), 1e-12)
+        self._metadatas = metadatas
+        self._ef = embedding_function
+
+    def count(self) -> int:
+        return len(self._metadatas)
+
+    def query(self, query_texts: list[str], n_results: int = 1) -> dict:
+        """Top-n benchmarks per query text by cosine similarity, best first."""
+        k = min(n_results, self.count())
+        if not query_texts or k <= 0:
+            return {"metadatas": [[] for _ in query_texts]}
+
+        q = np.asarray(self._ef(list(query_texts)), dtype=np.float32)
+        q /= np.maximum(np.linalg.norm(q, axis=1, keepdims=True), 1e-12)
+        sims = q @ self._emb.T  # (queries, benchmarks)
+
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        order = np.take_along_axis(sims, top, axis=1).argsort(axis=1)[:, ::-1]
+        top = np.take_along_axis(top, order, axis=1)
+
+        return {"metadatas": [[dict(self._metadatas[j]) for j in row] for row in top]}
+
+
+def build_vector_store(persist_path: str | None = None) -> BenchmarkIndex:
+    """
+    Build the in-memory benchmark index.
+
+    Args:
+        persist_path: Directory for the embedding cache. Uses config default if None.
+
+    Returns:
+        BenchmarkIndex ready for querying.
+    """
+    cache_dir = Path(persist_path or config.CHROMA_DB_PATH)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    ef = CachedEmbeddingFunction(
+        model_name=EMBEDDING_MODEL,
+        cache_path=str(cache_dir / "embedding_cache.sqlite3"),
+    )
+
+    documents, metadatas, _ = _benchmark_documents()
+    embeddings = _load_precomputed_embeddings(documents)
+    if embeddings is None:
+        embeddings = ef(documents)
+
+    index = BenchmarkIndex(embeddings, metadatas, ef)
+    logger.info(f"✅ Benchmark index ready with {index.count()} documents")
+    return index
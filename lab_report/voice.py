@@ -5,10 +5,15 @@ Converts the AI summary text into MP3 audio using gTTS.
 Supports English, Telugu, and Hindi.
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from gtts import gTTS
 from pathlib import Path
+import hashlib
+import os
+import shutil
 import tempfile
 from scripts.logger import get_logger
+from scripts.config import config
 
 logger = get_logger("lab_report.voice")
 
@@ -19,6 +24,13 @@ LANGUAGE_CODES = {
     "Hindi": "hi",
 }
 
+_ABNORMAL = frozenset({"CRITICAL", "HIGH", "LOW"})
+
+# gTTS is network-bound, so section clips are fetched on this many threads.
+# The pool lives for the process, so repeat calls don't pay thread start-up.
+TTS_MAX_WORKERS = 8
+_TTS_POOL = ThreadPoolExecutor(max_workers=TTS_MAX_WORKERS, thread_name_prefix="tts")
+
 
 def generate_audio(text: str, language: str = "English", output_path: str | None = None) -> str:
     """
@@ -38,15 +50,37 @@ def generate_audio(text: str, language: str = "English", output_path: str | None
         tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3")
         output_path = tmp.name
 
+    cached = _audio_cache_path(text, lang_code)
+    if cached is not None and cached.exists():
+        shutil.copyfile(cached, output_path)
+        logger.info(f"✅ Audio cache hit: {output_path}")
+        return output_path
+
     logger.info(f"Generating {language} audio → {output_path}")
 
     tts = gTTS(text=text, lang=lang_code, slow=False)
     tts.save(output_path)
 
+    if cached is not None and Path(output_path).exists():
+        # Write-then-rename so concurrent readers never see a partial MP3
+        cached.parent.mkdir(parents=True, exist_ok=True)
+        fd, partial = tempfile.mkstemp(dir=cached.parent, suffix=".part")
+        os.close(fd)
+        shutil.copyfile(output_path, partial)
+        os.replace(partial, cached)
+
     logger.info(f"✅ Audio saved: {output_path}")
     return output_path
 
 
+def _audio_cache_path(text: str, lang_code: str) -> Path | None:
+    """Where the MP3 for (lang, text) is cached; None when caching is disabled."""
+    if not config.AUDIO_CACHE_DIR:
+        return None
+    key = hashlib.sha256(f"{lang_code}|{text}".encode("utf-8")).hexdigest()
+    return Path(config.AUDIO_CACHE_DIR) / f"{key}.mp3"
+
+
 def generate_section_audios(classified_values: list[dict], language: str = "English") -> list[dict]:
     """
     Generate short audio clips for critical/abnormal findings only.
@@ -55,25 +89,32 @@ def generate_section_audios(classified_values: list[dict], language: str = "Engl
     Returns:
         List of {"test", "status", "audio_path"} dicts.
     """
-    audio_items = []
-    for item in classified_values:
-        if item["status"] in ("CRITICAL", "HIGH", "LOW"):
-            direction = "high" if item["status"] in ("HIGH", "CRITICAL") else "low"
-            status_label = item["status"]
-
-            if language == "Hindi":
-                msg = f"{item['test']} का स्तर {direction} है। कृपया डॉक्टर से मिलें।"
-            elif language == "Telugu":
-                msg = f"{item['test']} స్థాయి {direction}గా ఉంది. దయచేసి వైద్యుడిని సంప్రదించండి."
-            else:
-                msg = f"{item['test']} is {status_label}. Your value is {item['value']} {item['unit']}, normal range is {item['benchmark_min']} to {item['benchmark_max']}."
-
-            audio_path = generate_audio(msg, language)
-            audio_items.append({
-                "test": item["test"],
-                "status": item["status"],
-                "audio_path": audio_path,
-                "message": msg,
-            })
-
-    return audio_items
+    abnormal = [item for item in classified_values if item["status"] in _ABNORMAL]
+    if not abnormal:
+        return []
+
+    messages = []
+    for item in abnormal:
+        direction = "high" if item["status"] in ("HIGH", "CRITICAL") else "low"
+        status_label = item["status"]
+
+        if language == "Hindi":
+            msg = f"{item['test']} का स्तर {direction} है। कृपया डॉक्टर से मिलें।"
+        elif language == "Telugu":
+            msg = f"{item['test']} స్థాయి {direction}గా ఉంది. దయచేసి వైద్యుడిని సంప్రదించండి."
+        else:
+            msg = f"{item['test']} is {status_label}. Your value is {item['value']} {item['unit']}, normal range is {item['benchmark_min']} to {item['benchmark_max']}."
+        messages.append(msg)
+
+    # One gTTS round-trip per clip, up to TTS_MAX_WORKERS in flight at once
+    audio_paths = list(_TTS_POOL.map(generate_audio, messages, [language] * len(messages)))
+
+    return [
+        {
+            "test": item["test"],
+            "status": item["status"],
+            "audio_path": audio_path,
+            "message": msg,
+        }
+        for item, msg, audio_path in zip(abnormal, messages, audio_paths)
+    ]
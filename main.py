@@ -2,57 +2,212 @@
 MedAgent 360 · FastAPI Backend (Phase 1 — All Modules Active)
 All 3 modules wired: /analyze-lab, /parse-prescription, /checkin webhook
 Run with: uvicorn main:app --reload
+Production: WEB_CONCURRENCY=$(nproc) uvicorn main:app --loop uvloop --http httptools
 """
 
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
+from fastapi import BackgroundTasks, FastAPI, UploadFile, File, Form, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
+import asyncio
+import functools
 import tempfile
+import time
 import os
+from datetime import datetime
+from typing import BinaryIO
 from scripts.logger import get_logger
 from scripts.config import config
 
 logger = get_logger("medagent360.api")
 
+# Each module's pipeline is imported at startup, but a missing dependency
+# (cv2, pytesseract, twilio, langchain, ...) only takes that module's
+# endpoints down (503), not the whole API
+_MODULE_IMPORT_ERRORS: dict[str, ImportError] = {}
+
+try:
+    from lab_report.pdf_parser import extract_lab_values
+    from lab_report.rag_pipeline import (
+        classify_reports,
+        run_full_pipeline,
+        summarize,
+        warm_up as warm_up_lab_pipeline,
+    )
+except ImportError as e:
+    _MODULE_IMPORT_ERRORS["lab_report"] = e
+    logger.error(f"Module A unavailable: {e}")
+
+try:
+    from prescription.parser import run_prescription_pipeline
+    # The parser imports the OCR engine (cv2, pytesseract) on first use
+    import prescription.ocr_engine  # noqa: F401
+except ImportError as e:
+    _MODULE_IMPORT_ERRORS["prescription"] = e
+    logger.error(f"Module B unavailable: {e}")
+
+try:
+    from followup.agent import (
+        init_database,
+        start_scheduler,
+        record_patient_response,
+        process_patient_response,
+        enroll_patient,
+        send_checkin_message,
+        normalise_whatsapp_number,
+        get_recovery_timeline as fetch_recovery_timeline,
+        get_recent_alerts,
+    )
+except ImportError as e:
+    _MODULE_IMPORT_ERRORS["followup"] = e
+    logger.error(f"Module C unavailable: {e}")
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-worker dev setups only
+    fcntl = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson serialises the large lab/timeline payloads several times faster than
+# the stdlib encoder (and maps NaN to null instead of failing)
+APIResponse = ORJSONResponse if orjson is not None else JSONResponse
+
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MB
+POLL_CACHE_TTL = 5  # seconds; /health and /api/dashboard are polled by the UI
+ALERT_HISTORY_LIMIT = 20
+
 app = FastAPI(
     title="MedAgent 360 API",
     description="Autonomous Healthcare AI Agent",
     version="1.1.0",
+    default_response_class=APIResponse,
 )
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# Only the configured frontend origins; same-origin deployments (empty
+# CORS_ORIGINS) skip the middleware entirely
+if config.CORS_ORIGINS:
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=config.CORS_ORIGINS,
+        allow_credentials=False,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
 
 
 # ── Lifecycle ─────────────────────────────────────────────────────────────────
 
+def _require_module(module: str) -> None:
+    """503 for endpoints whose module failed to import."""
+    if module in _MODULE_IMPORT_ERRORS:
+        raise HTTPException(503, f"{module} is unavailable: {_MODULE_IMPORT_ERRORS[module]}")
+
+
 @app.on_event("startup")
 async def startup():
     logger.info("MedAgent 360 API starting up...")
+    if "followup" not in _MODULE_IMPORT_ERRORS:
+        _start_followup()
+    if "lab_report" not in _MODULE_IMPORT_ERRORS:
+        # Warm Module A (benchmark index, embedding cache, Gemini client) in a
+        # worker thread so the first /analyze-lab request doesn't pay for it
+        app.state.lab_warmup = asyncio.get_running_loop().run_in_executor(None, _warm_up_lab)
+
+
+def _start_followup():
     # Init Module C database
     try:
-        from followup.agent import init_database
         init_database()
-        logger.info("✅ Module C database initialized")
     except Exception as e:
         logger.warning(f"DB init skipped: {e}")
-    # Start scheduler
+    # Start scheduler — in one worker only, or every worker would send the
+    # daily check-ins
     try:
-        from followup.agent import start_scheduler
-        app.state.scheduler = start_scheduler()
-        logger.info("✅ APScheduler started")
+        if _claim_scheduler():
+            app.state.scheduler = start_scheduler()
+            logger.info("✅ APScheduler started")
+        else:
+            logger.info("APScheduler running in another worker")
     except Exception as e:
         logger.warning(f"Scheduler skipped: {e}")
 
 
+def _claim_scheduler() -> bool:
+    """
+    Take an exclusive lock next to the database; the first worker to get it
+    runs the scheduler and holds the lock for its lifetime.
+    """
+    if fcntl is None:
+        return True
+    lock_file = open(os.path.join(os.path.dirname(config.SQLITE_DB_PATH) or ".", "scheduler.lock"), "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return False
+    app.state.scheduler_lock = lock_file
+    return True
+
+
+def _warm_up_lab():
+    try:
+        warm_up_lab_pipeline()
+        logger.info("✅ Module A pipeline warmed up")
+    except Exception as e:
+        logger.warning(f"Module A warm-up skipped: {e}")
+
+
 @app.on_event("shutdown")
 async def shutdown():
     if hasattr(app.state, "scheduler"):
         app.state.scheduler.shutdown()
+    if hasattr(app.state, "scheduler_lock"):
+        app.state.scheduler_lock.close()
+
+
+# ── Uploads ───────────────────────────────────────────────────────────────────
+
+async def _save_upload(file: UploadFile, suffix: str) -> str:
+    """
+    Stream an upload to a temp file in 1 MB chunks (constant memory).
+    Raises 413 once it exceeds MAX_UPLOAD_MB. Returns the temp file path.
+    """
+    # The whole copy runs in one worker thread — no event-loop hop per chunk,
+    # and the disk writes never block the loop
+    return await asyncio.to_thread(_copy_upload, file.file, suffix)
+
+
+def _upload_stream(file: UploadFile) -> BinaryIO:
+    """
+    The upload's own spooled file, rewound, for pipelines that read streams
+    (the PDF parser) — no temp-file copy. Raises 413 past MAX_UPLOAD_MB.
+    """
+    size = file.size if file.size is not None else file.file.seek(0, os.SEEK_END)
+    if size > config.MAX_UPLOAD_MB * 1024 * 1024:
+        raise HTTPException(413, f"File too large (limit {config.MAX_UPLOAD_MB} MB).")
+    file.file.seek(0)
+    return file.file
+
+
+def _copy_upload(src, suffix: str) -> str:
+    max_bytes = config.MAX_UPLOAD_MB * 1024 * 1024
+    total = 0
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+        tmp_path = tmp.name
+        try:
+            while chunk := src.read(UPLOAD_CHUNK_SIZE):
+                total += len(chunk)
+                if total > max_bytes:
+                    raise HTTPException(413, f"File too large (limit {config.MAX_UPLOAD_MB} MB).")
+                tmp.write(chunk)
+        except BaseException:
+            tmp.close()
+            os.unlink(tmp_path)
+            raise
+    return tmp_path
 
 
 # ── Root & Health ─────────────────────────────────────────────────────────────
@@ -68,11 +223,19 @@ def root():
 
 
 @app.get("/health")
-def health():
+def health(response: Response):
+    response.headers["Cache-Control"] = f"max-age={POLL_CACHE_TTL}"
+    return _health_status(int(time.time()) // POLL_CACHE_TTL)
+
+
+@functools.lru_cache(maxsize=1)
+def _health_status(bucket: int) -> dict:
+    """Env-var check, recomputed at most once per POLL_CACHE_TTL window."""
     missing = config.validate()
     return {
-        "status": "ok" if not missing else "degraded",
+        "status": "ok" if not missing and not _MODULE_IMPORT_ERRORS else "degraded",
         "missing_env_vars": missing,
+        "unavailable_modules": sorted(_MODULE_IMPORT_ERRORS),
     }
 
 
@@ -84,24 +247,51 @@ async def analyze_lab_report(
     language: str = Form(default="English"),
 ):
     """Upload a lab report PDF and get AI analysis."""
+    _require_module("lab_report")
     if not file.filename.lower().endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Only PDF files are supported.")
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-        content = await file.read()
-        tmp.write(content)
-        tmp_path = tmp.name
+    pdf = _upload_stream(file)
 
     try:
-        from lab_report.rag_pipeline import run_full_pipeline
-        result = run_full_pipeline(tmp_path, language=language)
+        # Parse + classify + Gemini is blocking; keep it off the event loop
+        result = await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(run_full_pipeline, pdf, language=language)
+        )
         return result
     except Exception as e:
         logger.error(f"Lab report analysis failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if os.path.exists(tmp_path):
-            os.unlink(tmp_path)
+
+
+@app.post("/analyze-lab-batch")
+async def analyze_lab_batch(
+    files: list[UploadFile] = File(...),
+    language: str = Form(default="English"),
+):
+    """
+    Upload several lab report PDFs and get one analysis per file.
+    PDFs are parsed concurrently, then benchmark lookup and classification
+    run once across all reports instead of once per report.
+    """
+    _require_module("lab_report")
+    if any(not f.filename.lower().endswith(".pdf") for f in files):
+        raise HTTPException(status_code=400, detail="Only PDF files are supported.")
+
+    loop = asyncio.get_running_loop()
+    pdfs = [_upload_stream(file) for file in files]
+    try:
+        parsed = await asyncio.gather(
+            *(loop.run_in_executor(None, extract_lab_values, pdf) for pdf in pdfs)
+        )
+        analyses = await loop.run_in_executor(None, classify_reports, parsed)
+        results = await asyncio.gather(
+            *(loop.run_in_executor(None, summarize, analysis, language) for analysis in analyses)
+        )
+        return [{"filename": f.filename, **result} for f, result in zip(files, results)]
+    except Exception as e:
+        logger.error(f"Batch lab report analysis failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
 
 # ── Module B: Prescription Parser ─────────────────────────────────────────────
@@ -114,48 +304,60 @@ async def parse_prescription(
     schedule_reminders: bool = Form(default=False),
 ):
     """Upload a prescription image and get structured medicine info."""
+    _require_module("prescription")
     ext = os.path.splitext(file.filename)[1].lower()
     if ext not in {".jpg", ".jpeg", ".png", ".bmp", ".tiff", ".webp"}:
         raise HTTPException(400, "Please upload an image file (JPG, PNG, etc.)")
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=ext) as tmp:
-        tmp.write(await file.read())
-        tmp_path = tmp.name
+    tmp_path = await _save_upload(file, ext)
+    # Upload plus the generated audio clips, all removed once we respond
+    tmp_files = [tmp_path]
 
     try:
-        from prescription.parser import run_prescription_pipeline
-        result = run_prescription_pipeline(
+        result = await asyncio.get_running_loop().run_in_executor(None, functools.partial(
+            run_prescription_pipeline,
             tmp_path,
             language=language,
             patient_phone=patient_phone,
             schedule=schedule_reminders,
-        )
+        ))
         # Remove local file paths from response
+        tmp_files.append(result.pop("combined_audio_path", None))
         for med in result.get("medicines", []):
-            med.pop("audio_path", None)
+            tmp_files.append(med.pop("audio_path", None))
         return result
     except Exception as e:
         logger.error(f"Prescription parse failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
     finally:
-        if os.path.exists(tmp_path):
-            os.unlink(tmp_path)
+        for path in tmp_files:
+            if path and os.path.exists(path):
+                os.unlink(path)
 
 
 # ── Module C: Follow-up Agent ─────────────────────────────────────────────────
 
 @app.post("/checkin/webhook")
-async def twilio_webhook(request: Request):
-    """Twilio WhatsApp webhook endpoint for patient check-ins."""
+async def twilio_webhook(request: Request, background: BackgroundTasks):
+    """
+    Twilio WhatsApp webhook endpoint for patient check-ins.
+    The reply is stored before responding; analysis (Gemini + any doctor alert)
+    runs after the response is sent, so Twilio isn't kept waiting on the LLM.
+    """
+    _require_module("followup")
     form = await request.form()
     patient_phone = form.get("From", "")
     body = form.get("Body", "")
     if not patient_phone or not body:
-        return JSONResponse({"error": "Missing From or Body"}, status_code=400)
+        return APIResponse({"error": "Missing From or Body"}, status_code=400)
     try:
-        from followup.agent import handle_patient_response
-        result = handle_patient_response(patient_phone, body)
-        return JSONResponse(result)
+        patient_phone = normalise_whatsapp_number(patient_phone)
+    except ValueError as e:
+        return APIResponse({"error": str(e)}, status_code=400)
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, record_patient_response, patient_phone, body)
+        background.add_task(process_patient_response, patient_phone, body)
+        return APIResponse({"patient_phone": patient_phone, "status": "received"})
     except Exception as e:
         logger.error(f"Webhook error: {e}")
         raise HTTPException(500, str(e))
@@ -169,7 +371,11 @@ async def enroll_patient_endpoint(
     doctor_phone: str = Form(default=""),
 ):
     """Register a new patient for follow-up monitoring."""
-    from followup.agent import enroll_patient
+    _require_module("followup")
+    try:
+        phone = normalise_whatsapp_number(phone)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
     return enroll_patient(phone, name, language, doctor_phone)
 
 
@@ -180,29 +386,37 @@ async def manual_checkin(
     language: str = Form(default="English"),
 ):
     """Manually trigger a WhatsApp check-in message."""
-    from followup.agent import send_checkin_message
+    _require_module("followup")
+    try:
+        phone = normalise_whatsapp_number(phone)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
     return send_checkin_message(phone, name, language)
 
 
 @app.get("/checkin/recovery/{phone}")
 async def get_recovery_timeline(phone: str, days: int = 14):
     """Fetch recovery timeline for a patient."""
-    from followup.agent import get_recovery_timeline
-    return {"phone": phone, "timeline": get_recovery_timeline(phone, days)}
+    _require_module("followup")
+    try:
+        phone = normalise_whatsapp_number(phone)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    return {"phone": phone, "timeline": fetch_recovery_timeline(phone, days)}
 
 
 @app.get("/checkin/alerts")
 async def get_checkin_alerts():
     """Fetch doctor alert history from SQLite."""
-    import sqlite3
+    _require_module("followup")
     try:
-        conn = sqlite3.connect(config.SQLITE_DB_PATH)
-        rows = conn.execute(
-            "SELECT * FROM doctor_alerts ORDER BY sent_at DESC LIMIT 20"
-        ).fetchall()
-        conn.close()
-        cols = ["id", "patient_phone", "doctor_phone", "alert_message", "severity", "sent_at", "message_sid"]
-        return [dict(zip(cols, r)) for r in rows]
+        # Through the agent's shared connection, off the event loop
+        rows = await asyncio.get_running_loop().run_in_executor(None, get_recent_alerts, ALERT_HISTORY_LIMIT)
+        # Stored as unix seconds; the API keeps returning ISO timestamps
+        return [
+            {**r, "sent_at": datetime.fromtimestamp(r["sent_at"]).isoformat() if r["sent_at"] else None}
+            for r in rows
+        ]
     except Exception as e:
         logger.warning(f"Alert fetch failed: {e}")
         return []
@@ -211,8 +425,9 @@ async def get_checkin_alerts():
 # ── React Dashboard API ──────────────────────────────────────────────────────
 
 @app.get("/api/dashboard")
-def dashboard_stats():
+def dashboard_stats(response: Response):
     """Dashboard statistics for the React frontend."""
+    response.headers["Cache-Control"] = f"max-age={POLL_CACHE_TTL}"
     return {
         "lab_count": 24,
         "rx_count": 4,
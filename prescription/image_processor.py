@@ -5,9 +5,11 @@ Pipeline: grayscale → denoise → binarize → deskew → enhance contrast
 Handles both printed and handwritten prescriptions.
 """
 
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
-from PIL import Image, ImageEnhance, ImageFilter
 from pathlib import Path
 from scripts.logger import get_logger
 
@@ -15,22 +17,53 @@ logger = get_logger("prescription.image_processor")
 
 SUPPORTED_FORMATS = {".jpg", ".jpeg", ".png", ".bmp", ".tiff", ".tif", ".webp"}
 
-
-def preprocess_image(image_path: str, output_path: str | None = None) -> tuple[str, np.ndarray]:
+# Non-local-means denoising is the hottest step; run it on the GPU when this
+# OpenCV build has CUDA and a device (stock pip wheels report zero devices)
+try:
+    _HAS_CUDA = cv2.cuda.getCudaEnabledDeviceCount() > 0
+except (AttributeError, cv2.error):
+    _HAS_CUDA = False
+
+# Per-thread GpuMat + Stream, reused across calls (FastAPI runs us on a pool)
+_cuda_local = threading.local()
+
+# Printed-prescription binarisation: Gaussian adaptive threshold + 2×2 close
+THRESHOLD_BLOCK_SIZE = 31
+THRESHOLD_C = 10
+_CLOSE_KERNEL = cv2.getStructuringElement(cv2.MORPH_RECT, (2, 2))
+
+# CPU denoising runs on overlapping tiles so each working set stays cache-sized
+# and tiles run in parallel. The overlap covers the NLM footprint (search +
+# template radius), so the stitched result equals a full-frame pass.
+DENOISE_TILE = 1024
+DENOISE_TILE_OVERLAP = 32
+
+# The skew angle is scale-invariant, so it's estimated on a downscaled copy.
+# Ink is smeared horizontally so each text row becomes a band whose edges
+# HoughLinesP can pick up as long straight lines.
+DESKEW_SCALE = 0.25
+_DESKEW_SMEAR_KERNEL = cv2.getStructuringElement(cv2.MORPH_RECT, (15, 1))
+
+# Blank paper kept around the inked area when cropping for OCR (Tesseract
+# likes a little border around text)
+TEXT_CROP_MARGIN = 20
+
+# Handwriting enhancement, matching PIL's Contrast(2.5) → Sharpness(2.0) →
+# ImageFilter.SHARPEN. Sharpness(f) blends toward PIL's SMOOTH kernel, i.e.
+# f·img − (f−1)·smooth(img), which is a single 3×3 convolution.
+HANDWRITING_CONTRAST = 2.5
+_SMOOTH_KERNEL = np.array([[1, 1, 1], [1, 5, 1], [1, 1, 1]], np.float32) / 13
+_IDENTITY_KERNEL = np.zeros((3, 3), np.float32)
+_IDENTITY_KERNEL[1, 1] = 1
+_SHARPNESS_KERNEL = 2.0 * _IDENTITY_KERNEL - 1.0 * _SMOOTH_KERNEL
+_SHARPEN_KERNEL = np.array([[-2, -2, -2], [-2, 32, -2], [-2, -2, -2]], np.float32) / 16
+
+
+def load_for_ocr(image_path: str) -> np.ndarray:
     """
-    Full preprocessing pipeline for prescription images.
-
-    Steps:
-    1. Load & validate image
-    2. Resize to optimal OCR resolution (300 DPI equivalent)
-    3. Convert to grayscale
-    4. Denoise
-    5. Adaptive binarization (handles uneven lighting)
-    6. Deskew (straighten tilted photos)
-    7. Morphological cleanup
-
-    Returns:
-        (output_path, processed_numpy_array)
+    Validate, decode and resize an image — the stage both preprocessing
+    pipelines share. Pass the result as `gray=` to run each pipeline's
+    mode-specific tail without decoding the file again.
     """
     path = Path(image_path)
     if not path.exists():
@@ -38,118 +71,247 @@ def preprocess_image(image_path: str, output_path: str | None = None) -> tuple[s
     if path.suffix.lower() not in SUPPORTED_FORMATS:
         raise ValueError(f"Unsupported format: {path.suffix}. Use: {SUPPORTED_FORMATS}")
 
-    logger.info(f"🖼️  Preprocessing: {path.name}")
-
-    # Step 1: Load
-    img = cv2.imread(str(image_path))
-    if img is None:
+    # Load as grayscale — the decoder skips colour conversion and the resize
+    # below touches one channel, not three
+    gray = cv2.imread(str(image_path), cv2.IMREAD_GRAYSCALE)
+    if gray is None:
         raise ValueError(f"Could not read image: {image_path}")
 
-    original_h, original_w = img.shape[:2]
+    original_h, original_w = gray.shape[:2]
     logger.info(f"  Original size: {original_w}x{original_h}")
 
-    # Step 2: Resize for optimal OCR (target ~2400px wide)
-    img = _resize_for_ocr(img, target_width=2400)
+    # Resize for optimal OCR (target ~2400px wide)
+    return _resize_for_ocr(gray, target_width=2400)
 
-    # Step 3: Grayscale
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
 
-    # Step 4: Denoise
-    denoised = cv2.fastNlMeansDenoising(gray, h=10, templateWindowSize=7, searchWindowSize=21)
+def preprocess_image(
+    image_path: str,
+    output_path: str | None = None,
+    gray: np.ndarray | None = None,
+) -> tuple[str | None, np.ndarray]:
+    """
+    Full preprocessing pipeline for prescription images.
 
-    # Step 5: Adaptive thresholding (handles shadows, uneven lighting)
-    binary = cv2.adaptiveThreshold(
-        denoised, 255,
-        cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-        cv2.THRESH_BINARY,
-        blockSize=31,
-        C=10,
-    )
+    Steps:
+    1. Load & validate image (decoded straight to grayscale)
+    2. Resize to optimal OCR resolution (300 DPI equivalent)
+    3. Denoise
+    4. Adaptive binarization (handles uneven lighting)
+    5. Deskew (straighten tilted photos)
+    6. Morphological cleanup
 
-    # Step 6: Deskew
-    deskewed = _deskew(binary)
+    Steps 1–2 are skipped when a load_for_ocr() frame is passed as gray
+    (it is left unmodified). The result is only written to disk when
+    output_path is given; OCR consumes the returned array directly.
 
-    # Step 7: Morphological cleanup — close small gaps in text
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (2, 2))
-    cleaned = cv2.morphologyEx(deskewed, cv2.MORPH_CLOSE, kernel)
+    Returns:
+        (output_path or None, processed_numpy_array)
+    """
+    logger.info(f"🖼️  Preprocessing: {Path(image_path).name}")
+
+    # Steps 1–2: Load + resize, unless the caller already did; only a frame
+    # loaded here may be reused as scratch space below
+    owns_gray = gray is None
+    if owns_gray:
+        gray = load_for_ocr(image_path)
+
+    # Steps 3–4: Denoise + adaptive thresholding (handles shadows, uneven
+    # lighting) — one upload/download when running on the GPU
+    binary = _denoise_and_binarize(gray, h=10)
+
+    # Step 5: Deskew — the resized frame is no longer needed, so a rotation
+    # is written into its buffer instead of a fresh one
+    deskewed = _deskew(binary, dst=gray if owns_gray else None)
 
-    # Save output
-    if output_path is None:
-        output_path = str(path.parent / f"{path.stem}_processed.png")
+    # Step 6: Morphological cleanup — close small gaps in text (in place)
+    cleaned = _close_gaps(deskewed)
 
-    cv2.imwrite(output_path, cleaned)
-    logger.info(f"  ✅ Saved preprocessed image: {output_path}")
+    if output_path is not None:
+        cv2.imwrite(output_path, cleaned)
+        logger.info(f"  ✅ Saved preprocessed image: {output_path}")
 
     return output_path, cleaned
 
 
-def preprocess_for_handwritten(image_path: str, output_path: str | None = None) -> tuple[str, np.ndarray]:
+def preprocess_for_handwritten(
+    image_path: str,
+    output_path: str | None = None,
+    gray: np.ndarray | None = None,
+) -> tuple[str | None, np.ndarray]:
     """
     Enhanced pipeline specifically for handwritten prescriptions.
     Uses stronger contrast enhancement and larger morphological kernels.
+    Accepts a shared load_for_ocr() frame as gray (left unmodified).
     """
-    path = Path(image_path)
-    logger.info(f"✍️  Handwritten preprocessing: {path.name}")
-
-    img = cv2.imread(str(image_path))
-    if img is None:
-        raise ValueError(f"Could not read image: {image_path}")
-
-    # Resize
-    img = _resize_for_ocr(img, target_width=2400)
+    logger.info(f"✍️  Handwritten preprocessing: {Path(image_path).name}")
 
-    # Use PIL for better contrast enhancement
-    pil_img = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
-    pil_img = ImageEnhance.Contrast(pil_img).enhance(2.5)
-    pil_img = ImageEnhance.Sharpness(pil_img).enhance(2.0)
-    pil_img = pil_img.filter(ImageFilter.SHARPEN)
+    if gray is None:
+        gray = load_for_ocr(image_path)
 
-    # Back to OpenCV
-    img = cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2BGR)
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    # Strong contrast + sharpening into fresh buffers (a shared frame stays
+    # intact), all single-channel
+    gray = _enhance_handwriting(gray)
 
     # Heavier denoising for handwriting
-    denoised = cv2.fastNlMeansDenoising(gray, h=15)
+    denoised = _denoise(gray, h=15)
 
-    # Otsu's binarization (better for handwriting)
-    _, binary = cv2.threshold(denoised, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    # Otsu's binarization (better for handwriting), in place — the denoised
+    # frame isn't needed afterwards
+    _, binary = cv2.threshold(denoised, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU, dst=denoised)
 
-    # Deskew
-    deskewed = _deskew(binary)
+    # Deskew, into the (now unused) enhanced frame's buffer
+    deskewed = _deskew(binary, dst=gray)
 
-    if output_path is None:
-        output_path = str(path.parent / f"{path.stem}_handwritten.png")
-
-    cv2.imwrite(output_path, deskewed)
+    if output_path is not None:
+        cv2.imwrite(output_path, deskewed)
     return output_path, deskewed
 
 
 # ── Helpers ───────────────────────────────────────────────────────────────────
 
 def _resize_for_ocr(img: np.ndarray, target_width: int = 2400) -> np.ndarray:
+    """
+    Scale to target_width both ways: small scans are upsampled, and 12–50 MP
+    phone photos are shrunk before denoising, whose cost grows with pixel
+    count while OCR accuracy has already plateaued.
+    """
     h, w = img.shape[:2]
-    if w < target_width:
+    if w != target_width:
         scale = target_width / w
         new_w = int(w * scale)
         new_h = int(h * scale)
-        img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_CUBIC)
+        # INTER_AREA averages source pixels when shrinking (no aliasing)
+        interpolation = cv2.INTER_CUBIC if w < target_width else cv2.INTER_AREA
+        img = cv2.resize(img, (new_w, new_h), interpolation=interpolation)
     return img
 
 
-def _deskew(binary_img: np.ndarray) -> np.ndarray:
-    """Detect and correct skew angle in scanned/photographed documents."""
-    try:
-        coords = np.column_stack(np.where(binary_img < 128))  # dark pixels
-        if len(coords) < 100:
-            return binary_img
+def _enhance_handwriting(gray: np.ndarray) -> np.ndarray:
+    """Contrast stretch around the mean (as a LUT), then two sharpening passes."""
+    mean = int(gray.mean() + 0.5)
+    lut = np.clip(mean + HANDWRITING_CONTRAST * (np.arange(256) - mean) + 0.5, 0, 255).astype(np.uint8)
+    gray = cv2.LUT(gray, lut)
+    gray = cv2.filter2D(gray, -1, _SHARPNESS_KERNEL)
+    return cv2.filter2D(gray, -1, _SHARPEN_KERNEL)
+
+
+def _denoise(gray: np.ndarray, h: float, template_window: int = 7, search_window: int = 21) -> np.ndarray:
+    """fastNlMeansDenoising on the GPU when available, else on the CPU."""
+    if _HAS_CUDA:
+        try:
+            return _denoise_cuda(gray, h, template_window, search_window)
+        except cv2.error as e:
+            logger.warning(f"  CUDA denoise failed: {e} — using CPU")
+    return _tiled_denoise(gray, h, template_window, search_window)
+
 
-        angle = cv2.minAreaRect(coords)[-1]
+def _tiled_denoise(gray: np.ndarray, h: float, template_window: int, search_window: int) -> np.ndarray:
+    height, width = gray.shape
+    if height <= DENOISE_TILE and width <= DENOISE_TILE:
+        return cv2.fastNlMeansDenoising(
+            gray, h=h, templateWindowSize=template_window, searchWindowSize=search_window,
+        )
+
+    overlap = max(DENOISE_TILE_OVERLAP, search_window // 2 + template_window // 2)
+    out = np.empty_like(gray)
+
+    def denoise_tile(origin: tuple[int, int]) -> None:
+        y, x = origin
+        y0, x0 = max(0, y - overlap), max(0, x - overlap)
+        y1, x1 = min(height, y + DENOISE_TILE + overlap), min(width, x + DENOISE_TILE + overlap)
+        tile = cv2.fastNlMeansDenoising(
+            gray[y0:y1, x0:x1], h=h, templateWindowSize=template_window, searchWindowSize=search_window,
+        )
+        th, tw = min(DENOISE_TILE, height - y), min(DENOISE_TILE, width - x)
+        out[y:y + th, x:x + tw] = tile[y - y0:y - y0 + th, x - x0:x - x0 + tw]
+
+    # OpenCV releases the GIL inside fastNlMeansDenoising, so threads overlap
+    origins = [(y, x) for y in range(0, height, DENOISE_TILE) for x in range(0, width, DENOISE_TILE)]
+    with ThreadPoolExecutor(max_workers=min(len(origins), os.cpu_count() or 1)) as pool:
+        list(pool.map(denoise_tile, origins))
+    return out
+
+
+def _cuda_state():
+    """This thread's CUDA stream, upload buffer and filters, created on first use."""
+    if not hasattr(_cuda_local, "stream"):
+        # Same sigma cv2.adaptiveThreshold derives for the Gaussian block
+        sigma = 0.3 * ((THRESHOLD_BLOCK_SIZE - 1) * 0.5 - 1) + 0.8
+        _cuda_local.stream = cv2.cuda.Stream()
+        _cuda_local.src = cv2.cuda_GpuMat()
+        _cuda_local.gaussian = cv2.cuda.createGaussianFilter(
+            cv2.CV_8UC1, cv2.CV_8UC1, (THRESHOLD_BLOCK_SIZE, THRESHOLD_BLOCK_SIZE), sigma,
+        )
+        _cuda_local.close = cv2.cuda.createMorphologyFilter(cv2.MORPH_CLOSE, cv2.CV_8UC1, _CLOSE_KERNEL)
+    return _cuda_local
 
-        # Normalize angle
-        if angle < -45:
-            angle = -(90 + angle)
-        else:
-            angle = -angle
+
+def _denoise_cuda(gray: np.ndarray, h: float, template_window: int, search_window: int) -> np.ndarray:
+    state = _cuda_state()
+    state.src.upload(gray, stream=state.stream)
+    dst = cv2.cuda.fastNlMeansDenoising(
+        state.src, h, search_window=search_window, block_size=template_window, stream=state.stream,
+    )
+    state.stream.waitForCompletion()
+    return dst.download()
+
+
+def _denoise_and_binarize(gray: np.ndarray, h: float) -> np.ndarray:
+    """_denoise followed by a Gaussian adaptive threshold, kept on the GPU when available."""
+    if _HAS_CUDA:
+        try:
+            return _denoise_and_binarize_cuda(gray, h)
+        except cv2.error as e:
+            logger.warning(f"  CUDA binarisation failed: {e} — using CPU")
+    # Thresholded in place: the denoised frame is a fresh buffer nobody else holds
+    denoised = _denoise(gray, h)
+    return cv2.adaptiveThreshold(
+        denoised, 255,
+        cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+        cv2.THRESH_BINARY,
+        blockSize=THRESHOLD_BLOCK_SIZE,
+        C=THRESHOLD_C,
+        dst=denoised,
+    )
+
+
+def _denoise_and_binarize_cuda(gray: np.ndarray, h: float) -> np.ndarray:
+    # OpenCV CUDA has no adaptiveThreshold: pixel > gaussian_mean − C, built
+    # from a Gaussian filter, a saturating offset and a compare
+    state = _cuda_state()
+    stream = state.stream
+    state.src.upload(gray, stream=stream)
+    denoised = cv2.cuda.fastNlMeansDenoising(state.src, h, search_window=21, block_size=7, stream=stream)
+    mean = state.gaussian.apply(denoised, stream=stream)
+    threshold = cv2.cuda.addWeighted(mean, 1.0, mean, 0.0, -THRESHOLD_C, stream=stream)
+    binary = cv2.cuda.compare(denoised, threshold, cv2.CMP_GT, stream=stream)
+    stream.waitForCompletion()
+    return binary.download()
+
+
+def _close_gaps(binary: np.ndarray) -> np.ndarray:
+    """Morphological close with the 2×2 kernel, on the GPU when available (else in place)."""
+    if _HAS_CUDA:
+        try:
+            state = _cuda_state()
+            state.src.upload(binary, stream=state.stream)
+            closed = state.close.apply(state.src, stream=state.stream)
+            state.stream.waitForCompletion()
+            return closed.download()
+        except cv2.error as e:
+            logger.warning(f"  CUDA morphology failed: {e} — using CPU")
+    return cv2.morphologyEx(binary, cv2.MORPH_CLOSE, _CLOSE_KERNEL, dst=binary)
+
+
+def _deskew(binary_img: np.ndarray, dst: np.ndarray | None = None) -> np.ndarray:
+    """
+    Detect and correct skew angle in scanned/photographed documents.
+    A rotated result is written into dst when given (same shape, not binary_img).
+    """
+    try:
+        angle = _skew_angle(binary_img)
+        if angle is None:
+            return binary_img
 
         # Only correct if skew is significant
         if abs(angle) < 0.5:
@@ -159,12 +321,64 @@ def _deskew(binary_img: np.ndarray) -> np.ndarray:
         h, w = binary_img.shape
         center = (w // 2, h // 2)
         M = cv2.getRotationMatrix2D(center, angle, 1.0)
+        # Nearest-neighbour keeps the image strictly 0/255 (cubic would blur
+        # edges into greys) and is the cheapest interpolation
         rotated = cv2.warpAffine(
             binary_img, M, (w, h),
-            flags=cv2.INTER_CUBIC,
+            flags=cv2.INTER_NEAREST,
             borderMode=cv2.BORDER_REPLICATE,
+            dst=dst,
         )
         return rotated
     except Exception as e:
         logger.warning(f"  Deskew failed: {e} — using original")
         return binary_img
+
+
+def crop_to_text(binary_img: np.ndarray, margin: int = TEXT_CROP_MARGIN) -> np.ndarray:
+    """
+    View of a binarised page trimmed to the rows and columns that hold ink,
+    plus a margin, so Tesseract doesn't lay out blank paper.
+    """
+    rows = np.flatnonzero(cv2.reduce(binary_img, 1, cv2.REDUCE_MIN).ravel() < 128)
+    cols = np.flatnonzero(cv2.reduce(binary_img, 0, cv2.REDUCE_MIN).ravel() < 128)
+    if not len(rows):
+        return binary_img
+    h, w = binary_img.shape
+    y0, y1 = max(0, rows[0] - margin), min(h, rows[-1] + margin + 1)
+    x0, x1 = max(0, cols[0] - margin), min(w, cols[-1] + margin + 1)
+    return binary_img[y0:y1, x0:x1]
+
+
+def count_text_lines(binary_img: np.ndarray) -> int:
+    """
+    Number of long straight text-row edges in a binarised page — a cheap
+    printed-vs-handwritten signal (typeset rows have ruler-straight baselines).
+    """
+    lines = _text_line_segments(binary_img)
+    return 0 if lines is None else len(lines)
+
+
+def _text_line_segments(binary_img: np.ndarray) -> np.ndarray | None:
+    """HoughLinesP segments along smeared text rows, on a DESKEW_SCALE copy."""
+    small = cv2.resize(binary_img, None, fx=DESKEW_SCALE, fy=DESKEW_SCALE, interpolation=cv2.INTER_AREA)
+    ink = cv2.dilate(cv2.compare(small, 128, cv2.CMP_LT), _DESKEW_SMEAR_KERNEL)
+    edges = cv2.Canny(ink, 50, 150)
+
+    width = small.shape[1]
+    return cv2.HoughLinesP(
+        edges, 1, np.pi / 720, threshold=width // 8, minLineLength=width // 4, maxLineGap=20,
+    )
+
+
+def _skew_angle(binary_img: np.ndarray) -> float | None:
+    """Median text-line angle in degrees (rotation that levels it), or None if no lines."""
+    lines = _text_line_segments(binary_img)
+    if lines is None:
+        return None
+
+    # Endpoints come back as int32; float32 is ample for the angle maths
+    x1, y1, x2, y2 = lines[:, 0].T.astype(np.float32)
+    angles = np.degrees(np.arctan2(y2 - y1, x2 - x1))
+    angles = angles[np.abs(angles) < 45]
+    return float(np.median(angles)) if len(angles) else None
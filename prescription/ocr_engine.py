@@ -5,6 +5,13 @@ Handles both printed and handwritten prescription text extraction.
 Supports English, Telugu (tel), and Hindi (hin) scripts.
 """
 
+import copy
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 import pytesseract
 import cv2
 import numpy as np
@@ -12,17 +19,51 @@ from PIL import Image
 from pathlib import Path
 from scripts.logger import get_logger
 
+# In-process Tesseract API (optional). pytesseract spawns the tesseract CLI per
+# call, which reloads the traineddata every time; tesserocr keeps it loaded.
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
 logger = get_logger("prescription.ocr_engine")
 
-# Tesseract configs for different prescription types
+# Tesseract configs for different prescription types. Prescriptions are one
+# column of lines in varying sizes, which is exactly PSM 4.
 OCR_CONFIGS = {
-    "printed_english": "--oem 3 --psm 6 -l eng",
-    "printed_telugu":  "--oem 3 --psm 6 -l tel+eng",
-    "printed_hindi":   "--oem 3 --psm 6 -l hin+eng",
-    "handwritten":     "--oem 1 --psm 6 -l eng",   # LSTM only, better for handwriting
+    "printed_english": "--oem 3 --psm 4 -l eng",
+    "printed_telugu":  "--oem 3 --psm 4 -l tel+eng",
+    "printed_hindi":   "--oem 3 --psm 4 -l hin+eng",
+    "handwritten":     "--oem 1 --psm 4 -l eng",   # LSTM only, better for handwriting
     "mixed":           "--oem 3 --psm 11 -l eng",  # Sparse text mode
 }
 
+# Printed-pass confidence tiers for auto-detection: at or above HIGH_CONF the
+# handwritten pass is skipped outright; below LOW_CONF it is always tried
+HIGH_CONF = 75
+LOW_CONF = 50
+
+# Pages with fewer straight text-row edges than this look handwritten, so the
+# handwritten pass is raced against the printed one instead of run after it
+PRINTED_MIN_TEXT_LINES = 5
+
+# Long-lived threads for the raced handwritten pass, so each keeps its warm
+# tesserocr API (thread-local) across requests; bounded, as every thread
+# holds its own loaded traineddata
+OCR_RACE_WORKERS = 2
+_race_pool = ThreadPoolExecutor(max_workers=OCR_RACE_WORKERS, thread_name_prefix="ocr-race")
+
+# Results keyed by a hash of the exact pixels plus config, so OCR of an image
+# seen before (re-analyze, repeat upload) skips Tesseract. LRU-bounded.
+OCR_CACHE_SIZE = 256
+_ocr_cache: OrderedDict[bytes, dict] = OrderedDict()
+_ocr_cache_lock = threading.Lock()
+
+# One initialised tesserocr API per (lang, oem, psm) per thread — an API
+# instance is not safe to share between the racing OCR passes
+_tess_local = threading.local()
+_CONFIG_RE = re.compile(r"--oem (\d+) --psm (\d+) -l (\S+)")
+
 
 def extract_text_from_image(
     image_input,  # path str or numpy array
@@ -45,35 +86,43 @@ def extract_text_from_image(
             "word_data": list[dict]  # if return_confidence=True
         }
     """
-    # Load image
+    # Load image — Tesseract binarises internally, so grayscale loses nothing
+    # and moves a third of the bytes a colour image would
     if isinstance(image_input, str):
-        img = cv2.imread(image_input)
+        img = cv2.imread(image_input, cv2.IMREAD_GRAYSCALE)
         if img is None:
             raise FileNotFoundError(f"Image not found: {image_input}")
-        pil_img = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
     elif isinstance(image_input, np.ndarray):
-        if len(image_input.shape) == 2:  # already grayscale
-            pil_img = Image.fromarray(image_input)
-        else:
-            pil_img = Image.fromarray(cv2.cvtColor(image_input, cv2.COLOR_BGR2RGB))
+        img = image_input
+        if img.ndim == 3:
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
     else:
         raise TypeError("image_input must be a file path or numpy array")
 
     config = OCR_CONFIGS.get(script, OCR_CONFIGS["printed_english"])
+    cache_key = _ocr_cache_key(img, config, return_confidence)
+    with _ocr_cache_lock:
+        cached = _ocr_cache.get(cache_key)
+        if cached is not None:
+            _ocr_cache.move_to_end(cache_key)
+    if cached is not None:
+        logger.info(f"🔤 OCR cache hit | config={script}")
+        return copy.deepcopy(cached)
+
+    pil_img = Image.fromarray(img)
+
     logger.info(f"🔤 Running OCR | config={script}")
 
-    # Extract text
-    raw_text = pytesseract.image_to_string(pil_img, config=config)
-    lines = [l.strip() for l in raw_text.split("\n") if l.strip()]
+    # One Tesseract pass gives both the words and their confidences; the text
+    # is rebuilt from the word boxes instead of running image_to_string too
+    data = _image_to_data(pil_img, config)
+    lines = _lines_from_data(data)
+    raw_text = "\n".join(lines)
 
-    # Get confidence data
-    try:
-        data = pytesseract.image_to_data(pil_img, config=config, output_type=pytesseract.Output.DICT)
-        confidences = [int(c) for c in data["conf"] if str(c).isdigit() and int(c) > 0]
-        avg_confidence = sum(confidences) / len(confidences) if confidences else 0.0
-    except Exception:
-        avg_confidence = 0.0
-        data = {}
+    # Tesseract reports -1 for non-word boxes; mask once, reuse for word_data
+    conf = np.asarray(data["conf"], dtype=np.float32)
+    scored = conf > 0
+    avg_confidence = float(conf[scored].mean()) if scored.any() else 0.0
 
     logger.info(f"  Extracted {len(lines)} lines | avg confidence: {avg_confidence:.1f}%")
 
@@ -83,39 +132,135 @@ def extract_text_from_image(
         "confidence": round(avg_confidence, 1),
     }
 
-    if return_confidence and data:
+    if return_confidence:
         result["word_data"] = [
             {"word": w, "conf": c}
-            for w, c in zip(data.get("text", []), data.get("conf", []))
-            if w.strip() and str(c).isdigit() and int(c) > 0
+            for w, c, ok in zip(data["text"], data["conf"], scored.tolist())
+            if ok and w.strip()
         ]
 
+    # Callers annotate the dict they get back, so the cache keeps its own copy
+    with _ocr_cache_lock:
+        _ocr_cache[cache_key] = copy.deepcopy(result)
+        if len(_ocr_cache) > OCR_CACHE_SIZE:
+            _ocr_cache.popitem(last=False)
+
     return result
 
 
+def _image_to_data(pil_img: Image.Image, config: str) -> dict:
+    """Word-level OCR in pytesseract's image_to_data DICT layout."""
+    if tesserocr is None:
+        return pytesseract.image_to_data(pil_img, config=config, output_type=pytesseract.Output.DICT)
+
+    api = _tess_api(config)
+    api.SetImage(pil_img)
+    api.Recognize()
+
+    RIL = tesserocr.RIL
+    data = {"page_num": [], "block_num": [], "par_num": [], "line_num": [], "text": [], "conf": []}
+    block = par = line = 0
+    it = api.GetIterator()
+    if it is not None:
+        for word in tesserocr.iterate_level(it, RIL.WORD):
+            if word.IsAtBeginningOf(RIL.BLOCK):
+                block += 1
+            if word.IsAtBeginningOf(RIL.PARA):
+                par += 1
+            if word.IsAtBeginningOf(RIL.TEXTLINE):
+                line += 1
+            data["page_num"].append(1)
+            data["block_num"].append(block)
+            data["par_num"].append(par)
+            data["line_num"].append(line)
+            data["text"].append(word.GetUTF8Text(RIL.WORD) or "")
+            data["conf"].append(word.Confidence(RIL.WORD))
+    return data
+
+
+def _tess_api(config: str):
+    """This thread's tesserocr API for an OCR_CONFIGS string, created on first use."""
+    apis = getattr(_tess_local, "apis", None)
+    if apis is None:
+        apis = _tess_local.apis = {}
+    api = apis.get(config)
+    if api is None:
+        oem, psm, lang = _CONFIG_RE.fullmatch(config).groups()
+        api = apis[config] = tesserocr.PyTessBaseAPI(lang=lang, oem=int(oem), psm=int(psm))
+    return api
+
+
+def _lines_from_data(data: dict) -> list[str]:
+    """Join image_to_data words into text lines, in reading order."""
+    lines: dict[tuple, list[str]] = {}
+    keys = zip(data["page_num"], data["block_num"], data["par_num"], data["line_num"])
+    for key, word in zip(keys, data["text"]):
+        if word.strip():
+            lines.setdefault(key, []).append(word.strip())
+    return [" ".join(words) for words in lines.values()]
+
+
+def _ocr_cache_key(img: np.ndarray, config: str, return_confidence: bool) -> bytes:
+    # blake2b runs at GB/s — negligible next to a Tesseract pass
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{img.shape}|{img.dtype}|{config}|{return_confidence}".encode())
+    h.update(np.ascontiguousarray(img).data)
+    return h.digest()
+
+
 def auto_detect_and_extract(image_path: str) -> dict:
     """
     Auto-detect prescription type (printed/handwritten/mixed) and
     run the best OCR configuration. Falls back gracefully.
     """
-    from prescription.image_processor import preprocess_image, preprocess_for_handwritten
+    from prescription.image_processor import count_text_lines, crop_to_text, load_for_ocr, preprocess_image
 
     logger.info(f"🔍 Auto-detecting prescription type: {Path(image_path).name}")
 
-    # Try printed first
-    processed_path, processed_arr = preprocess_image(image_path)
+    # Decode + resize once; both passes branch off this frame read-only
+    base = load_for_ocr(image_path)
+
+    # Try printed first (in memory — nothing is written to disk)
+    _, processed_arr = preprocess_image(image_path, gray=base)
+    likely_printed = count_text_lines(processed_arr) >= PRINTED_MIN_TEXT_LINES
+    processed_arr = crop_to_text(processed_arr)
+
+    if not likely_printed:
+        # Likely handwritten: the second pass will almost surely be needed, so
+        # run both at once (OpenCV and Tesseract release the GIL)
+        logger.info("  Few straight text lines — racing printed and handwritten OCR")
+        hw_future = _race_pool.submit(_handwritten_ocr, image_path, base)
+        result_printed = extract_text_from_image(processed_arr, script="printed_english")
+        return _pick_mode(result_printed, hw_future.result())
+
     result_printed = extract_text_from_image(processed_arr, script="printed_english")
 
-    # If confidence is low, try handwritten mode
-    if result_printed["confidence"] < 50:
+    if result_printed["confidence"] >= HIGH_CONF:
+        result_printed["detection_mode"] = "printed"
+        return result_printed
+
+    # Low confidence or barely any text read — try handwritten mode
+    if result_printed["confidence"] < LOW_CONF or len(result_printed["lines"]) < 3:
         logger.info("  Low confidence — trying handwritten mode")
-        hw_path, hw_arr = preprocess_for_handwritten(image_path)
-        result_hw = extract_text_from_image(hw_arr, script="handwritten")
+        return _pick_mode(result_printed, _handwritten_ocr(image_path, base))
+
+    result_printed["detection_mode"] = "printed"
+    return result_printed
+
+
+def _handwritten_ocr(image_path: str, base: np.ndarray) -> dict:
+    from prescription.image_processor import crop_to_text, preprocess_for_handwritten
+
+    _, hw_arr = preprocess_for_handwritten(image_path, gray=base)
+    return extract_text_from_image(crop_to_text(hw_arr), script="handwritten")
+
 
-        if result_hw["confidence"] > result_printed["confidence"]:
-            logger.info(f"  Handwritten mode better: {result_hw['confidence']:.1f}% vs {result_printed['confidence']:.1f}%")
-            result_hw["detection_mode"] = "handwritten"
-            return result_hw
+def _pick_mode(result_printed: dict, result_hw: dict) -> dict:
+    """The handwritten result if it scored higher, else the printed one."""
+    if result_hw["confidence"] > result_printed["confidence"]:
+        logger.info(f"  Handwritten mode better: {result_hw['confidence']:.1f}% vs {result_printed['confidence']:.1f}%")
+        result_hw["detection_mode"] = "handwritten"
+        return result_hw
 
     result_printed["detection_mode"] = "printed"
     return result_printed
@@ -9,8 +9,13 @@ B6: APScheduler medication reminders
 
 import json
 import re
+import shutil
 import sqlite3
-from datetime import datetime, timedelta
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from functools import lru_cache
 from pathlib import Path
 
 from langchain_google_genai import ChatGoogleGenerativeAI
@@ -22,8 +27,33 @@ from apscheduler.triggers.cron import CronTrigger
 from scripts.logger import get_logger
 from scripts.config import config
 
+try:
+    import orjson
+except ImportError:  # stdlib json is used when orjson isn't installed
+    orjson = None
+
 logger = get_logger("prescription.parser")
 
+# ── Patterns ──────────────────────────────────────────────────────────────────
+_JSON_FENCE_RE = re.compile(r"```json\s*|\s*```")
+# Common medicine patterns, for the regex fallback
+_MEDICINE_RE = re.compile(
+    r"([A-Z][a-zA-Z\s]+(?:\d+mg|\d+ml)?)\s*[-–]?\s*"
+    r"(\d+\s*(?:tablet|tab|cap|capsule|ml)s?)?",
+    re.IGNORECASE
+)
+_DURATION_RE = re.compile(r"(\d+)\s*(day|week|month)")
+
+
+def _json_loads(raw: str):
+    # orjson.JSONDecodeError subclasses json.JSONDecodeError, so callers
+    # catch the same exception either way
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+
+def _json_dumps(obj) -> str:
+    return orjson.dumps(obj).decode() if orjson is not None else json.dumps(obj)
+
 # ── Translation Maps (fallback if IndicTrans unavailable) ─────────────────────
 COMMON_MEDICINE_TRANSLATIONS = {
     "Telugu": {
@@ -43,7 +73,9 @@ COMMON_MEDICINE_TRANSLATIONS = {
 }
 
 
+@lru_cache(maxsize=1)
 def _get_llm():
+    """One Gemini client per process, shared by extraction and translation."""
     return ChatGoogleGenerativeAI(
         model="gemini-3-flash-preview",
         google_api_key=config.GOOGLE_API_KEY,
@@ -105,10 +137,10 @@ Rules:
 
     raw = response.content.strip()
     # Strip markdown code blocks if present
-    raw = re.sub(r"```json\s*|\s*```", "", raw).strip()
+    raw = _JSON_FENCE_RE.sub("", raw).strip()
 
     try:
-        medicines = json.loads(raw)
+        medicines = _json_loads(raw)
         if not isinstance(medicines, list):
             medicines = [medicines]
         logger.info(f"  Extracted {len(medicines)} medicines")
@@ -121,13 +153,7 @@ Rules:
 def _fallback_medicine_extraction(text: str) -> list[dict]:
     """Regex fallback if LLM JSON parsing fails."""
     medicines = []
-    # Common medicine patterns
-    pattern = re.compile(
-        r"([A-Z][a-zA-Z\s]+(?:\d+mg|\d+ml)?)\s*[-–]?\s*"
-        r"(\d+\s*(?:tablet|tab|cap|capsule|ml)s?)?",
-        re.IGNORECASE
-    )
-    for m in pattern.finditer(text):
+    for m in _MEDICINE_RE.finditer(text):
         name = m.group(1).strip()
         if len(name) > 3 and not name.lower().startswith(("date", "name", "age", "doctor")):
             medicines.append({
@@ -155,25 +181,17 @@ def translate_prescription(medicines: list[dict], target_language: str) -> list[
         return medicines
 
     llm = _get_llm()
-    translated = []
+    script = target_language if target_language in ("Telugu", "Hindi") else "Hindi"
+    instructions = [_build_instruction(med, "English") for med in medicines]
 
-    for med in medicines:
-        instruction_en = _build_instruction(med, "English")
-
-        lang_prompts = {
-            "Telugu": f"Translate this medicine instruction to Telugu script: '{instruction_en}'",
-            "Hindi":  f"Translate this medicine instruction to Hindi script: '{instruction_en}'",
-        }
-        prompt = lang_prompts.get(target_language, lang_prompts["Hindi"])
-        prompt += "\nReturn ONLY the translated text. No explanation."
-
-        try:
-            response = llm.invoke([HumanMessage(content=prompt)])
-            translated_text = response.content.strip()
-        except Exception as e:
-            logger.warning(f"Translation failed for {med['medicine']}: {e}")
-            translated_text = instruction_en  # fallback to English
+    # One round-trip for the whole prescription; per-medicine calls only if
+    # the batched reply can't be parsed
+    translations = _translate_batch(llm, instructions, script)
+    if translations is None:
+        translations = [_translate_one(llm, text, script) for text in instructions]
 
+    translated = []
+    for med, instruction_en, translated_text in zip(medicines, instructions, translations):
         translated.append({
             **med,
             "instruction_english": instruction_en,
@@ -185,6 +203,44 @@ def translate_prescription(medicines: list[dict], target_language: str) -> list[
     return translated
 
 
+def _translate_batch(llm, instructions: list[str], script: str) -> list[str] | None:
+    """Translate every instruction in one call; None if the reply isn't a matching JSON array."""
+    if not instructions:
+        return []
+    prompt = (
+        f"Translate each of these medicine instructions to {script} script.\n"
+        f"{json.dumps(instructions, ensure_ascii=False)}\n"
+        "Return ONLY a JSON array of the translated strings, in the same order. No explanation."
+    )
+    try:
+        response = llm.invoke([HumanMessage(content=prompt)])
+        raw = _JSON_FENCE_RE.sub("", response.content.strip()).strip()
+        translations = _json_loads(raw)
+    except Exception as e:
+        logger.warning(f"Batch translation failed: {e} — translating one by one")
+        return None
+
+    if (
+        not isinstance(translations, list)
+        or len(translations) != len(instructions)
+        or not all(isinstance(t, str) for t in translations)
+    ):
+        logger.warning("Batch translation returned a mismatched array — translating one by one")
+        return None
+    return [t.strip() for t in translations]
+
+
+def _translate_one(llm, instruction_en: str, script: str) -> str:
+    prompt = f"Translate this medicine instruction to {script} script: '{instruction_en}'"
+    prompt += "\nReturn ONLY the translated text. No explanation."
+    try:
+        response = llm.invoke([HumanMessage(content=prompt)])
+        return response.content.strip()
+    except Exception as e:
+        logger.warning(f"Translation failed for '{instruction_en}': {e}")
+        return instruction_en  # fallback to English
+
+
 def _build_instruction(med: dict, language: str) -> str:
     """Build a human-readable instruction string from medicine dict."""
     parts = [f"Take {med.get('medicine', 'this medicine')}"]
@@ -205,31 +261,60 @@ def _build_instruction(med: dict, language: str) -> str:
 
 LANG_CODES = {"English": "en", "Telugu": "te", "Hindi": "hi"}
 
+# gTTS is one network round-trip per clip, so medicines are voiced concurrently
+TTS_MAX_WORKERS = 8
+
 def generate_medicine_audio(medicines: list[dict], language: str = "English") -> list[dict]:
     """
     Generate MP3 audio for each medicine instruction.
     Returns medicines with "audio_path" added.
     """
-    import tempfile
     lang_code = LANG_CODES.get(language, "en")
+    if not medicines:
+        return medicines
 
-    for med in medicines:
-        text = med.get("instruction_translated") or med.get("instruction_english", "")
-        if not text:
-            continue
-        try:
-            tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3", prefix="rx_")
-            tts = gTTS(text=text, lang=lang_code, slow=False)
-            tts.save(tmp.name)
-            med["audio_path"] = tmp.name
-            logger.info(f"  🔊 Audio: {med['medicine']} → {tmp.name}")
-        except Exception as e:
-            logger.warning(f"  Audio failed for {med['medicine']}: {e}")
-            med["audio_path"] = None
+    # Each worker writes only its own medicine's "audio_path"
+    with ThreadPoolExecutor(max_workers=min(TTS_MAX_WORKERS, len(medicines))) as pool:
+        list(pool.map(_medicine_audio, medicines, [lang_code] * len(medicines)))
 
     return medicines
 
 
+def _medicine_audio(med: dict, lang_code: str) -> None:
+    text = med.get("instruction_translated") or med.get("instruction_english", "")
+    if not text:
+        return
+    try:
+        tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3", prefix="rx_")
+        tts = gTTS(text=text, lang=lang_code, slow=False)
+        tts.save(tmp.name)
+        med["audio_path"] = tmp.name
+        logger.info(f"  🔊 Audio: {med['medicine']} → {tmp.name}")
+    except Exception as e:
+        logger.warning(f"  Audio failed for {med['medicine']}: {e}")
+        med["audio_path"] = None
+
+
+def combine_medicine_audio(medicines: list[dict]) -> str | None:
+    """
+    Join the per-medicine MP3s, in list order, into one file so a client can
+    play the whole prescription from a single clip. gTTS emits bare MPEG
+    frames, so plain concatenation is a valid MP3 — no re-encode needed.
+    """
+    paths = [m["audio_path"] for m in medicines if m.get("audio_path")]
+    if not paths:
+        return None
+    try:
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3", prefix="rx_all_") as out:
+            for path in paths:
+                with open(path, "rb") as f:
+                    shutil.copyfileobj(f, out)
+        return out.name
+    except OSError as e:
+        logger.warning(f"  Combined audio failed: {e}")
+        return None
+
+
 # ── B6: Reminder Scheduler ────────────────────────────────────────────────────
 
 def schedule_reminders(medicines: list[dict], patient_phone: str, db_path: str | None = None) -> list[dict]:
@@ -238,30 +323,11 @@ def schedule_reminders(medicines: list[dict], patient_phone: str, db_path: str |
     APScheduler picks these up via Module C.
     """
     db_path = db_path or config.SQLITE_DB_PATH
-    Path(db_path).parent.mkdir(parents=True, exist_ok=True)
-
-    conn = sqlite3.connect(db_path)
-    cur = conn.cursor()
-
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS medication_reminders (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            patient_phone TEXT NOT NULL,
-            medicine_name TEXT NOT NULL,
-            dosage TEXT,
-            frequency TEXT,
-            timing TEXT,
-            duration_days INTEGER,
-            start_date TEXT,
-            end_date TEXT,
-            reminder_times TEXT,
-            created_at TEXT,
-            active INTEGER DEFAULT 1
-        )
-    """)
 
     scheduled = []
-    start_date = datetime.now().date()
+    rows = []
+    now = datetime.now()
+    start_date = now.date()
 
     for med in medicines:
         # Parse duration
@@ -271,36 +337,125 @@ def schedule_reminders(medicines: list[dict], patient_phone: str, db_path: str |
         # Build reminder times from frequency
         reminder_times = _frequency_to_times(med.get("frequency", ""))
 
-        cur.execute("""
-            INSERT INTO medication_reminders
-            (patient_phone, medicine_name, dosage, frequency, timing, duration_days,
-             start_date, end_date, reminder_times, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
+        rows.append((
             patient_phone,
             med.get("medicine", "Unknown"),
             med.get("dosage", ""),
             med.get("frequency", ""),
             med.get("timing", ""),
             duration_days,
-            str(start_date),
-            str(end_date) if end_date else None,
-            json.dumps(reminder_times),
-            datetime.now().isoformat(),
+            _epoch(start_date),
+            _epoch(end_date) if end_date else None,
+            _json_dumps(reminder_times),
+            int(now.timestamp()),
         ))
 
         scheduled.append({**med, "reminder_times": reminder_times, "end_date": str(end_date)})
         logger.info(f"  ⏰ Scheduled: {med.get('medicine')} at {reminder_times}")
 
-    conn.commit()
-    conn.close()
+    # One prepared statement and one transaction for the whole prescription
+    with _reminder_db_lock:
+        conn = _get_reminder_db(db_path)
+        conn.executemany("""
+            INSERT INTO medication_reminders
+            (patient_phone, medicine_name, dosage, frequency, timing, duration_days,
+             start_date, end_date, reminder_times, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+        conn.commit()
+
     return scheduled
 
 
+# Long-lived connection per database file; the schema check and pragmas run
+# once, on first use. Shared across request threads, so callers hold the lock.
+_reminder_dbs: dict[str, sqlite3.Connection] = {}
+_reminder_db_lock = threading.Lock()
+
+
+def _get_reminder_db(db_path: str) -> sqlite3.Connection:
+    conn = _reminder_dbs.get(db_path)
+    if conn is not None:
+        return conn
+
+    Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    # WAL + NORMAL: one cheap sync per commit instead of a full fsync dance
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(_REMINDERS_TABLE_SQL)
+    _migrate_reminder_dates(conn)
+    conn.commit()
+    _reminder_dbs[db_path] = conn
+    return conn
+
+
+# Dates are unix seconds (local midnight for start/end) for compact rows and
+# plain integer range scans
+_REMINDERS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS medication_reminders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_phone TEXT NOT NULL,
+        medicine_name TEXT NOT NULL,
+        dosage TEXT,
+        frequency TEXT,
+        timing TEXT,
+        duration_days INTEGER,
+        start_date INTEGER,
+        end_date INTEGER,
+        reminder_times TEXT,
+        created_at INTEGER,
+        active INTEGER DEFAULT 1
+    )
+"""
+
+
+def _migrate_reminder_dates(conn: sqlite3.Connection) -> None:
+    """
+    Databases created before the switch stored ISO date strings; convert them
+    once. Check and rewrite share one write lock (concurrent workers), and
+    only text values are converted, so a repeat run is a no-op.
+    """
+    conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        columns = {row[1]: row[2] for row in conn.execute("PRAGMA table_info(medication_reminders)")}
+        if columns.get("start_date") == "INTEGER":
+            conn.commit()
+            return
+
+        logger.info("Migrating medication_reminders dates to unix seconds")
+        conn.execute("ALTER TABLE medication_reminders RENAME TO medication_reminders_old")
+        conn.execute(_REMINDERS_TABLE_SQL)
+        conn.execute("""
+            INSERT INTO medication_reminders
+            SELECT id, patient_phone, medicine_name, dosage, frequency, timing, duration_days,
+                   CASE WHEN typeof(start_date) = 'text'
+                        THEN CAST(strftime('%s', start_date, 'utc') AS INTEGER) ELSE start_date END,
+                   CASE WHEN typeof(end_date) = 'text'
+                        THEN CAST(strftime('%s', end_date, 'utc') AS INTEGER) ELSE end_date END,
+                   reminder_times,
+                   CASE WHEN typeof(created_at) = 'text'
+                        THEN CAST(strftime('%s', created_at, 'utc') AS INTEGER) ELSE created_at END,
+                   active
+            FROM medication_reminders_old
+        """)
+        conn.execute("DROP TABLE medication_reminders_old")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def _epoch(day: date) -> int:
+    """Unix seconds at local midnight of `day`."""
+    return int(datetime.combine(day, datetime.min.time()).timestamp())
+
+
 def _parse_duration_days(duration_str: str) -> int:
     if not duration_str:
         return 7  # default 7 days
-    m = re.search(r"(\d+)\s*(day|week|month)", duration_str.lower())
+    m = _DURATION_RE.search(duration_str.lower())
     if m:
         n = int(m.group(1))
         unit = m.group(2)
@@ -351,12 +506,18 @@ def run_prescription_pipeline(
     # B4: Translate
     medicines = translate_prescription(medicines, language)
 
-    # B5: Audio
-    medicines = generate_medicine_audio(medicines, language)
-
-    # B6: Schedule reminders
+    # B5 + B6: Audio (network) and reminder storage (disk) are independent, so
+    # run them side by side. Scheduling gets its own copies so audio_path can
+    # be added concurrently; its reminder fields are merged back afterwards.
     if schedule and patient_phone:
-        medicines = schedule_reminders(medicines, patient_phone)
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            sched_future = pool.submit(schedule_reminders, [dict(m) for m in medicines], patient_phone)
+            audio_future = pool.submit(generate_medicine_audio, medicines, language)
+            medicines = audio_future.result()
+            scheduled = sched_future.result()
+        medicines = [{**med, **sched} for med, sched in zip(medicines, scheduled)]
+    else:
+        medicines = generate_medicine_audio(medicines, language)
 
     return {
         "medicines": medicines,
@@ -365,4 +526,5 @@ def run_prescription_pipeline(
         "detection_mode": ocr_result.get("detection_mode", "printed"),
         "language": language,
         "medicine_count": len(medicines),
+        "combined_audio_path": combine_medicine_audio(medicines),
     }
@@ -0,0 +1,33 @@
+"""
+MedAgent 360 · Module B · Tests
+Unit tests for the prescription parser's reminder storage.
+Run with: pytest prescription/tests/ -v
+"""
+
+import sqlite3
+
+from prescription.parser import _REMINDERS_TABLE_SQL, _migrate_reminder_dates
+
+ISO_START = "2026-02-27"
+
+
+# ── Reminder Date Migration Tests ─────────────────────────────────────────────
+
+class TestReminderDateMigration:
+    def test_migrate_twice_is_idempotent(self, tmp_path):
+        conn = sqlite3.connect(tmp_path / "b.db")
+        legacy_sql = _REMINDERS_TABLE_SQL
+        for col in ("start_date", "end_date", "created_at"):
+            legacy_sql = legacy_sql.replace(f"{col} INTEGER", f"{col} TEXT")
+        conn.execute(legacy_sql)
+        conn.execute(
+            "INSERT INTO medication_reminders (patient_phone, medicine_name, start_date) VALUES (?, ?, ?)",
+            ("whatsapp:+919800000001", "Dolo 650", ISO_START),
+        )
+        conn.commit()
+
+        _migrate_reminder_dates(conn)
+        _migrate_reminder_dates(conn)
+
+        expected = conn.execute("SELECT CAST(strftime('%s', ?, 'utc') AS INTEGER)", (ISO_START,)).fetchone()[0]
+        assert conn.execute("SELECT start_date FROM medication_reminders").fetchone()[0] == expected
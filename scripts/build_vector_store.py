@@ -0,0 +1,26 @@
+"""
+MedAgent 360 · Build-time asset
+Build the benchmark assets ahead of time so the server starts without
+embedding anything: the precomputed MiniLM embeddings (benchmarks_emb.npz),
+then, from those, the persistent ChromaDB collection (when chromadb is
+installed) and the embedding cache behind the NumPy index under CHROMA_DB_PATH.
+Run during deploy/image build, and again whenever MEDICAL_BENCHMARKS changes;
+ship lab_report/data alongside the app.
+Usage: python scripts/build_vector_store.py [persist_path]
+"""
+
+import sys
+import os
+
+# Add project root to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lab_report import vector_store, vector_store_np
+
+
+if __name__ == "__main__":
+    persist_path = sys.argv[1] if len(sys.argv) > 1 else None
+    print(f"Embeddings: {vector_store.export_benchmark_embeddings()}")
+    print(f"NumPy index: {vector_store_np.build_vector_store(persist_path).count()} documents")
+    if vector_store.chromadb is not None:
+        print(f"ChromaDB: {vector_store.build_vector_store(persist_path).count()} documents")
@@ -28,6 +28,17 @@ class Config:
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
     SQLITE_DB_PATH: str = os.getenv("SQLITE_DB_PATH", "./data/medagent.db")
     CHROMA_DB_PATH: str = os.getenv("CHROMA_DB_PATH", "./lab_report/data/chroma_db")
+    MAX_UPLOAD_MB: int = int(os.getenv("MAX_UPLOAD_MB", "50"))
+    AUDIO_CACHE_DIR: str = os.getenv("AUDIO_CACHE_DIR", "./data/audio_cache")
+    # API worker processes; uvicorn reads the same variable as its --workers default
+    WEB_CONCURRENCY: int = max(1, int(os.getenv("WEB_CONCURRENCY") or 1))
+    # PDF parser processes per worker; by default each worker gets an equal
+    # share of the cores, so all workers together start about one per core
+    PDF_PARSE_WORKERS: int = int(os.getenv("PDF_PARSE_WORKERS") or 0) or max(1, (os.cpu_count() or 1) // WEB_CONCURRENCY)
+    # Comma-separated browser origins allowed to call the API; empty disables CORS
+    CORS_ORIGINS: list[str] = [
+        o.strip() for o in os.getenv("CORS_ORIGINS", "http://localhost:5173").split(",") if o.strip()
+    ]
 
     # ── ngrok ─────────────────────────────────────────────────────────────────
     NGROK_TUNNEL_URL: str = os.getenv("NGROK_TUNNEL_URL", "")
@@ -4,14 +4,66 @@ Full UI for all 3 modules with live demo support.
 Run with: streamlit run app.py
 """
 import streamlit as st
-import tempfile, os, json
+import tempfile, os, json, threading, importlib
 import pandas as pd
+from dateutil.tz import tzlocal
+from concurrent.futures import ThreadPoolExecutor
 
 st.set_page_config(
     page_title="MedAgent 360", page_icon="🏥", layout="wide",
     initial_sidebar_state="expanded",
 )
 
+
+@st.cache_resource(show_spinner=False)
+def _start_warm_up():
+    """Once per server: load Chroma, the embedding model and Gemini in the background."""
+    def _load():
+        try:
+            from lab_report.rag_pipeline import warm_up
+            warm_up()
+        except Exception:
+            pass  # the first analysis will surface the error to the user
+        # Pre-import the other modules' pipelines (OpenCV, Tesseract, Twilio,
+        # LangChain) so the first click on those pages doesn't pay for it
+        for module in ("prescription.parser", "followup.agent"):
+            try:
+                importlib.import_module(module)
+            except Exception:
+                pass
+    threading.Thread(target=_load, daemon=True).start()
+    return True
+
+
+_start_warm_up()
+
+# Results-table cell styles by lab status
+STATUS_CSS = {
+    "CRITICAL": "background-color:#ff4444;color:white",
+    "HIGH":     "background-color:#ff9900;color:white",
+    "LOW":      "background-color:#ffcc00",
+    "NORMAL":   "background-color:#00cc44;color:white",
+}
+
+
+def _highlight_status(col: pd.Series) -> pd.Series:
+    return col.map(STATUS_CSS).fillna("")
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _lab_table(columns: dict) -> pd.DataFrame:
+    """Display frame for the results table, built once per classified report."""
+    df = pd.DataFrame(columns)
+    if df.empty:
+        return df
+    display_cols = ["risk_icon","test","value","unit","status","benchmark_min","benchmark_max","benchmark_unit","deviation_pct"]
+    return df[display_cols].rename(columns={
+        "risk_icon":"", "test":"Test","value":"Your Value","unit":"Unit",
+        "status":"Status","benchmark_min":"Normal Min","benchmark_max":"Normal Max",
+        "benchmark_unit":"Normal Unit","deviation_pct":"Deviation %"
+    })
+
+
 # ── Sidebar ──────────────────────────────────────────────────────────────────
 with st.sidebar:
     st.markdown("## 🏥 MedAgent 360")
@@ -62,6 +114,75 @@ elif page == "🔬 Lab Report (PS #24)":
     st.title("🔬 Lab Report Intelligence")
     st.caption("Upload a blood test PDF → AI explains it in your language with voice output")
 
+    @st.fragment
+    def render_lab_report(analysis: dict, language: str):
+        """Language-dependent part of the report: Gemini summary, explanations, audio."""
+        try:
+            from lab_report.rag_pipeline import summarize
+            with st.spinner("🤖 Analysing with Gemini AI..."):
+                result = summarize(analysis, language, include_summary=False)
+
+            # Patient header
+            info = result["patient_info"]
+            st.subheader(f"👤 {info['name']}  |  Age: {info['age']}  |  {info['date']}")
+            st.caption(f"Extraction method: `{result.get('extraction_method','—')}`")
+
+            # Stats bar
+            s = result["stats"]
+            c1,c2,c3,c4 = st.columns(4)
+            c1.metric("Total Tests", s["total"])
+            c2.metric("✅ Normal", s["normal"])
+            c3.metric("⚠️ Abnormal", s["abnormal"])
+            c4.metric("🚨 Critical", s["critical"], delta_color="inverse")
+
+            # Critical alert banner
+            if result["critical_flags"]:
+                st.error(f"🚨 **CRITICAL VALUES DETECTED:** {', '.join(result['critical_flags'])} — Please see a doctor immediately!")
+                expls = result.get("critical_explanations", {})
+                for test, explanation in expls.items():
+                    st.warning(f"**{test}:** {explanation}")
+
+            # Results table (slot reserved here, filled once TTS is running)
+            st.subheader("📊 Test Results")
+            table_slot = st.container()
+
+            # AI Summary
+            st.subheader(f"🤖 AI Summary ({language})")
+            from lab_report.rag_pipeline import stream_summary
+            with st.container(border=True):
+                summary_text = st.write_stream(stream_summary(
+                    result["classified_values"], result["patient_info"], language,
+                    raw_text=result.get("raw_text", ""),
+                ))
+
+            # TTS only needs the summary text — run it in the background
+            # while the results table is built and rendered.
+            from lab_report.voice import generate_audio
+            with ThreadPoolExecutor(max_workers=1) as tts_pool:
+                audio_future = tts_pool.submit(generate_audio, summary_text, language)
+
+                with table_slot:
+                    df_display = _lab_table(analysis["classified_columns"])
+                    if not df_display.empty:
+                        # Style only the Status column, one vectorised map instead of a call per row
+                        st.dataframe(df_display.style.apply(_highlight_status, subset=["Status"]), use_container_width=True, height=400)
+
+                # Audio player
+                st.subheader("🔊 Listen to Summary")
+                with st.spinner("Generating audio..."):
+                    try:
+                        audio_path = audio_future.result()
+                        # Streamlit loads the file into its media store here,
+                        # so the temp file can go straight away
+                        st.audio(audio_path, format="audio/mp3")
+                        os.unlink(audio_path)
+                    except Exception as e:
+                        st.warning(f"Audio unavailable: {e}")
+
+        except Exception as e:
+            st.error(f"❌ Analysis failed: {e}")
+            st.exception(e)
+
     uploaded = st.file_uploader("Upload Lab Report PDF", type=["pdf"])
 
     if uploaded:
@@ -70,78 +191,21 @@ elif page == "🔬 Lab Report (PS #24)":
         with col2:
             analyze = st.button("🔍 Analyze Report", type="primary", use_container_width=True)
 
+        # Parse + classify once per upload and keep it in the session, so a
+        # language switch only reruns the summary fragment's Gemini work.
         if analyze:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-                tmp.write(uploaded.getbuffer())
-                tmp_path = tmp.name
-
-            with st.spinner("🤖 Analysing with Gemini AI..."):
+            with st.spinner("📄 Reading report..."):
                 try:
-                    from lab_report.rag_pipeline import run_full_pipeline
-                    result = run_full_pipeline(tmp_path, language=language)
-
-                    # Patient header
-                    info = result["patient_info"]
-                    st.subheader(f"👤 {info['name']}  |  Age: {info['age']}  |  {info['date']}")
-                    st.caption(f"Extraction method: `{result.get('extraction_method','—')}`")
-
-                    # Stats bar
-                    s = result["stats"]
-                    c1,c2,c3,c4 = st.columns(4)
-                    c1.metric("Total Tests", s["total"])
-                    c2.metric("✅ Normal", s["normal"])
-                    c3.metric("⚠️ Abnormal", s["abnormal"])
-                    c4.metric("🚨 Critical", s["critical"], delta_color="inverse")
-
-                    # Critical alert banner
-                    if result["critical_flags"]:
-                        st.error(f"🚨 **CRITICAL VALUES DETECTED:** {', '.join(result['critical_flags'])} — Please see a doctor immediately!")
-                        expls = result.get("critical_explanations", {})
-                        for test, explanation in expls.items():
-                            st.warning(f"**{test}:** {explanation}")
-
-                    # Results table
-                    st.subheader("📊 Test Results")
-                    df = pd.DataFrame(result["classified_values"])
-                    if not df.empty:
-                        display_cols = [c for c in ["risk_icon","test","value","unit","status","benchmark_min","benchmark_max","benchmark_unit","deviation_pct"] if c in df.columns]
-                        df_display = df[display_cols].rename(columns={
-                            "risk_icon":"", "test":"Test","value":"Your Value","unit":"Unit",
-                            "status":"Status","benchmark_min":"Normal Min","benchmark_max":"Normal Max",
-                            "benchmark_unit":"Normal Unit","deviation_pct":"Deviation %"
-                        })
-
-                        def highlight(row):
-                            colors = {"CRITICAL":"background-color:#ff4444;color:white",
-                                      "HIGH":"background-color:#ff9900;color:white",
-                                      "LOW":"background-color:#ffcc00",
-                                      "NORMAL":"background-color:#00cc44;color:white"}
-                            return [colors.get(row.get("Status",""), "") if col=="Status" else "" for col in df_display.columns]
-
-                        st.dataframe(df_display.style.apply(highlight, axis=1), use_container_width=True, height=400)
-
-                    # AI Summary
-                    st.subheader(f"🤖 AI Summary ({language})")
-                    st.info(result["summary"])
-
-                    # Audio player
-                    st.subheader("🔊 Listen to Summary")
-                    with st.spinner("Generating audio..."):
-                        try:
-                            from lab_report.voice import generate_audio
-                            audio_path = generate_audio(result["summary"], language)
-                            with open(audio_path, "rb") as f:
-                                st.audio(f.read(), format="audio/mp3")
-                            os.unlink(audio_path)
-                        except Exception as e:
-                            st.warning(f"Audio unavailable: {e}")
-
+                    from lab_report.rag_pipeline import parse_and_classify_cached
+                    st.session_state["lab_analysis"] = (uploaded.file_id, parse_and_classify_cached(uploaded.getvalue()))
                 except Exception as e:
+                    st.session_state.pop("lab_analysis", None)
                     st.error(f"❌ Analysis failed: {e}")
                     st.exception(e)
-                finally:
-                    if os.path.exists(tmp_path):
-                        os.unlink(tmp_path)
+
+        file_id, analysis = st.session_state.get("lab_analysis", (None, None))
+        if analysis is not None and file_id == uploaded.file_id:
+            render_lab_report(analysis, language)
 
 
 # ═══════════════════════════════════════════════════════════════════
@@ -179,8 +243,14 @@ elif page == "💊 Prescription (PS #22)":
                     st.success(f"✅ Found **{result['medicine_count']} medicines** | OCR confidence: {result['ocr_confidence']:.1f}%")
                     st.caption(f"Detection mode: `{result.get('detection_mode','—')}`")
 
-                    # Medicine cards
+                    # Medicine cards — one player for the whole prescription,
+                    # medicines in card order
                     st.subheader("💊 Medicines Found")
+                    combined_audio = result.get("combined_audio_path")
+                    if combined_audio and not os.path.exists(combined_audio):
+                        combined_audio = None
+                    if combined_audio:
+                        st.audio(combined_audio, format="audio/mp3")
                     for i, med in enumerate(result["medicines"]):
                         with st.expander(f"💊 {med.get('medicine','Medicine')} ({med.get('dosage','—')})", expanded=i<3):
                             c1,c2,c3 = st.columns(3)
@@ -191,10 +261,9 @@ elif page == "💊 Prescription (PS #22)":
                                 st.info(f"📝 {med['special_notes']}")
                             if med.get("instruction_translated"):
                                 st.markdown(f"**{language}:** {med['instruction_translated']}")
-                            # Audio
-                            if med.get("audio_path") and os.path.exists(med["audio_path"]):
-                                with open(med["audio_path"], "rb") as f:
-                                    st.audio(f.read(), format="audio/mp3")
+                            # Audio (only when there's no combined clip)
+                            if not combined_audio and med.get("audio_path") and os.path.exists(med["audio_path"]):
+                                st.audio(med["audio_path"], format="audio/mp3")
 
                     # OCR text expander
                     with st.expander("📄 Raw OCR Text"):
@@ -244,12 +313,17 @@ elif page == "📞 Follow-up Agent (PS #23)":
         m_lang  = st.selectbox("Language", ["English","Telugu","Hindi"], key="manual_lang")
         if st.button("📨 Send Now", type="primary"):
             if m_phone:
-                from followup.agent import send_checkin_message
-                result = send_checkin_message(m_phone, m_name or "Patient", m_lang)
-                if result.get("success"):
-                    st.success(f"✅ Check-in sent! SID: {result.get('message_sid')}")
+                from followup.agent import normalise_whatsapp_number, send_checkin_message
+                try:
+                    m_phone = normalise_whatsapp_number(m_phone)
+                except ValueError as e:
+                    st.error(str(e))
                 else:
-                    st.error(f"Failed: {result.get('error')}")
+                    result = send_checkin_message(m_phone, m_name or "Patient", m_lang)
+                    if result.get("success"):
+                        st.success(f"✅ Check-in sent! SID: {result.get('message_sid')}")
+                    else:
+                        st.error(f"Failed: {result.get('error')}")
             else:
                 st.warning("Enter a phone number")
 
@@ -290,18 +364,24 @@ elif page == "🚨 Alerts & Recovery":
 
     tab1, tab2 = st.tabs(["🚨 Doctor Alerts", "📈 Recovery Timeline"])
 
+    # Served from the agent's shared connection; the short TTL absorbs
+    # rerun bursts while new alerts still show up within seconds
+    @st.cache_data(ttl=5, show_spinner=False)
+    def _recent_alerts():
+        from followup.agent import get_recent_alerts
+        return get_recent_alerts(20)
+
     with tab1:
         st.subheader("Recent Doctor Alerts")
         try:
-            import sqlite3
-            from scripts.config import config
-            from followup.agent import init_database
-            init_database()
-            conn = sqlite3.connect(config.SQLITE_DB_PATH)
-            rows = conn.execute("SELECT patient_phone,severity,sent_at,alert_message FROM doctor_alerts ORDER BY sent_at DESC LIMIT 20").fetchall()
-            conn.close()
+            rows = _recent_alerts()
             if rows:
-                df = pd.DataFrame(rows, columns=["Patient","Severity","Sent At","Message"])
+                df = pd.DataFrame(rows)[["patient_phone","severity","sent_at","alert_message"]]
+                df.columns = ["Patient","Severity","Sent At","Message"]
+                # Stored as unix seconds; shown in server-local time, as /checkin/alerts does
+                df["Sent At"] = (
+                    pd.to_datetime(df["Sent At"], unit="s", utc=True).dt.tz_convert(tzlocal()).dt.tz_localize(None)
+                )
                 st.dataframe(df, use_container_width=True)
             else:
                 st.info("No alerts yet. They will appear here when Module C detects critical symptoms.")
@@ -313,13 +393,15 @@ elif page == "🚨 Alerts & Recovery":
         r_phone = st.text_input("Enter patient phone", placeholder="+91XXXXXXXXXX")
         if r_phone:
             try:
-                from followup.agent import get_recovery_timeline
-                timeline = get_recovery_timeline(r_phone)
+                from followup.agent import get_recovery_timeline, normalise_whatsapp_number
+                timeline = get_recovery_timeline(normalise_whatsapp_number(r_phone))
                 if timeline:
                     df = pd.DataFrame(timeline)
                     st.line_chart(df.set_index("date")["pain_level"].dropna())
                     st.dataframe(df, use_container_width=True)
                 else:
                     st.info("No recovery data for this patient yet.")
+            except ValueError as e:
+                st.error(str(e))
             except Exception as e:
                 st.warning(f"Could not load timeline: {e}")